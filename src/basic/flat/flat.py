@@ -3,21 +3,34 @@
 """Flat classification trained and tested on each HPO term.
 """
 import json
+import os
+import shutil
+import tempfile
 import time
 from collections import defaultdict
 import pandas as pd
 from scipy import sparse
 import numpy as np
+from joblib import Parallel, delayed, dump, load
+from scipy import special
 from sklearn.linear_model import LogisticRegression
 from src.utils.ontology import HumanPhenotypeOntology, get_ns_id
-from src.utils.file_reader import load_protein, load_annotation, load_feature
+from src.utils.file_reader import load_protein, load_annotation, \
+    load_feature, save_result
+from src.utils.network import prune_network
+from src.utils.vocabulary import Vocabulary
 
 
 def df_to_csr(df):
     """Convert Pandas DataFrame to SciPy sparse matrix.
-    :param df: a Pandas DataFrame
-    :return: the contents of the frame as a sparse SciPy CSR matrix
+    :param df: a Pandas DataFrame, or SciPy sparse matrix which is returned
+        as CSR matrix directly
+    :return: the contents of the frame as a sparse SciPy CSR matrix, sparse
+        matrix keeps its dtype and shares its arrays (e.g. memory map) with
+        df instead of being copied
     """
+    if sparse.issparse(df):
+        return sparse.csr_matrix(df, copy=False)
     return sparse.csr_matrix(df.values)
 
 
@@ -55,17 +68,166 @@ class SameModel:
         return self.predict(X)
 
 
+class MultiLabelLogisticRegression:
+    """Logistic regression fitted on all HPO terms at once.
+
+    The weights of all HPO terms form a dense matrix, so every mini-batch
+    step updates all terms with one sparse-dense product (optimized by Adam).
+    HPO terms with only one class in ground truth are not trained, their
+    scores are fixed by the bias vector instead (i.e. the role of SameModel),
+    which is clipped into [-max_bias, max_bias] to stay finite.
+
+    Attributes:
+        - coef_: weights, numpy array of shape (n_features, n_labels)
+        - intercept_: bias, numpy array of shape (n_labels, )
+    """
+    def __init__(self, C=1.0, learning_rate=0.01, n_epochs=20,
+                 batch_size=256, max_bias=30., random_state=0):
+        """
+        :param C: inverse of regularization strength, the same as C of
+            sklearn.linear_model.LogisticRegression
+        :param learning_rate: step size of Adam
+        :param n_epochs: number of passes over the training data
+        :param batch_size: number of proteins in each mini-batch
+        :param max_bias: bound of absolute value of bias, the default gives
+            scores of about 1e-13 (or 1 - 1e-13) to HPO terms of one class
+        :param random_state: seed used to shuffle proteins
+        :return: None
+        """
+        self.C = C
+        self.learning_rate = learning_rate
+        self.n_epochs = n_epochs
+        self.batch_size = batch_size
+        self.max_bias = max_bias
+        self.random_state = random_state
+        self.coef_ = None
+        self.intercept_ = None
+
+    def fit(self, X, Y):
+        """Fit weights of all HPO terms.
+        :param X: feature matrix, SciPy sparse matrix or numpy array of shape
+            (n_samples, n_features)
+        :param Y: label matrix, numpy array of shape (n_samples, n_labels),
+            the values are 0/1
+        :return: None
+        """
+        X = sparse.csr_matrix(X, dtype=np.float32)
+        Y = np.asarray(Y, dtype=np.float32)
+        n_samples, n_features = X.shape
+        frequency = Y.mean(axis=0)
+        # HPO terms with both classes in ground truth
+        active = np.flatnonzero((frequency > 0) & (frequency < 1))
+        Y = Y[:, active]
+
+        # constant labels become bias of -max_bias/+max_bias (instead of
+        # -inf/+inf), i.e. scores of almost 0/1
+        with np.errstate(divide="ignore"):
+            self.intercept_ = np.clip(
+                np.log(frequency / (1 - frequency)), -self.max_bias,
+                self.max_bias).astype(np.float32)
+        self.coef_ = np.zeros((n_features, len(frequency)), dtype=np.float32)
+
+        W = np.zeros((n_features, len(active)), dtype=np.float32)
+        b = self.intercept_[active].copy()
+        # moment estimates of Adam
+        m_W, v_W = np.zeros_like(W), np.zeros_like(W)
+        m_b, v_b = np.zeros_like(b), np.zeros_like(b)
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        alpha = 1. / (self.C * n_samples)
+
+        rng = np.random.RandomState(self.random_state)
+        step = 0
+        for _ in range(self.n_epochs):
+            order = rng.permutation(n_samples)
+            for start in range(0, n_samples, self.batch_size):
+                batch = order[start:start + self.batch_size]
+                X_batch = X[batch]
+                # gradient of averaged log-loss plus L2 penalty
+                G = (special.expit(X_batch @ W + b) - Y[batch]) / len(batch)
+                grad_W = X_batch.T @ G + alpha * W
+                grad_b = G.sum(axis=0)
+
+                step += 1
+                lr = self.learning_rate * np.sqrt(1 - beta2 ** step) / \
+                    (1 - beta1 ** step)
+                for param, grad, m, v in ((W, grad_W, m_W, v_W),
+                                          (b, grad_b, m_b, v_b)):
+                    m *= beta1
+                    m += (1 - beta1) * grad
+                    v *= beta2
+                    v += (1 - beta2) * grad ** 2
+                    param -= lr * m / (np.sqrt(v) + eps)
+
+        self.coef_[:, active] = W
+        self.intercept_[active] = b
+
+    def predict_proba(self, X):
+        """Return probability score of each protein on each HPO term.
+        :param X: feature matrix, SciPy sparse matrix or numpy array
+        :return: numpy array of shape (n_samples, n_labels)
+        """
+        X = sparse.csr_matrix(X, dtype=np.float32)
+        return special.expit(X @ self.coef_ + self.intercept_)
+
+
+def share_matrix(matrix, folder):
+    """Dump matrix into folder and load it back as read-only memory map, so
+    that worker processes open the same file instead of receiving a pickled
+    copy of the matrix in each task.
+    :param matrix: numpy array or SciPy sparse matrix
+    :param folder: directory to hold the memory-mapped file
+    :return: memory-mapped matrix with the same contents
+    """
+    path = os.path.join(folder, "matrix.joblib")
+    dump(matrix, path)
+    return load(path, mmap_mode="r")
+
+
 class FlatModel:
-    def __init__(self, model):
+    """Flat classifiers, one per HPO term.
+
+    Attributes:
+        - _model (private): name of model, valid values includes:
+            - "lr": one logistic regression per HPO term
+            - "mlr": one multi-label logistic regression for all HPO terms
+        - _model_param (private): dict, keyword arguments of the model, e.g.
+            C of "lr", learning_rate, n_epochs, batch_size and C (L2) of "mlr"
+        - _n_jobs (private): number of worker processes used in fitting,
+            1 means fitting in serial, -1 means using all CPUs, "mlr" fits
+            all HPO terms in a single model so it always runs in serial
+        - _classifiers (private): dict, key: HPO term, value: classifier
+        - _multi_label (private): MultiLabelLogisticRegression of "mlr"
+        - _hpo_terms (private): HPO terms (columns) of _multi_label
+    """
+    def __init__(self, model, n_jobs=1):
+        """
+        :param model: name of model, or dict with the name under key "name"
+            and keyword arguments of the model under the other keys, e.g.
+            { "name": "mlr", "learning_rate": 0.01, "n_epochs": 20 }
+        :param n_jobs: number of worker processes used in fitting, ignored
+            by "mlr"
+        :return: None
+        """
+        if isinstance(model, dict):
+            self._model_param = {key: value for key, value in model.items()
+                                 if key != "name"}
+            model = model["name"]
+        else:
+            self._model_param = dict()
         self._model = model
+        self._n_jobs = n_jobs
         self._classifiers = dict()
+        self._multi_label = None
+        self._hpo_terms = list()
 
     def _get_model(self):
         """Return model prototype you need.
         :return: model prototype
         """
         if self._model == "lr":
-            return LogisticRegression()
+            return LogisticRegression(**self._model_param)
+        elif self._model == "mlr":
+            return MultiLabelLogisticRegression(**self._model_param)
         else:
             raise ValueError("Can't recognize the model %s" % self._model)
 
@@ -74,14 +236,16 @@ class FlatModel:
 
         N.B. The number of proteins in feature and annotation are MUST be the
             SAME!!!
-        :param feature: features, DataFrame instance with rows being proteins
-            and columns being HPO terms, the values are real number
+        :param feature: features, DataFrame instance (or SciPy sparse matrix)
+            with rows being proteins and columns being HPO terms, the values
+            are real number
         :param annotation: HPO annotations, DataFrame instance with rows being
             proteins and columns being HPO terms, the values are 0/1
         :return: None
         """
-        assert isinstance(feature, pd.DataFrame), \
-            "Argument feature must be Pandas DataFrame instance."
+        assert isinstance(feature, pd.DataFrame) or sparse.issparse(feature), \
+            "Argument feature must be Pandas DataFrame instance or SciPy " \
+            "sparse matrix."
         assert isinstance(annotation, pd.DataFrame), \
             "Argument annotation must be Pandas DataFrame instance."
         assert feature.shape[0] == annotation.shape[0], \
@@ -89,37 +253,112 @@ class FlatModel:
             "the same."
 
         X = df_to_csr(feature)
-        for hpo_term in annotation.columns:
-            y = np.asarray(annotation[[hpo_term]])[:, 0]
+        hpo_terms = annotation.columns.tolist()
+        Y = np.asarray(annotation)
+        self._classifiers = dict()
+
+        if self._model == "mlr":
+            # all HPO terms are fitted together in a single model, in serial
+            self._multi_label = self._get_model()
+            self._multi_label.fit(X, Y)
+            self._hpo_terms = hpo_terms
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                  "Fit", len(hpo_terms), "HPO terms")
+            return
+
+        # split HPO terms into batches, several batches per worker to
+        # balance the load, progress is reported once per batch
+        n_workers = os.cpu_count() if self._n_jobs < 0 else self._n_jobs
+        batches = [batch for batch in
+                   np.array_split(np.arange(len(hpo_terms)), 4 * n_workers)
+                   if len(batch) > 0]
+        if self._n_jobs == 1:
+            self._update_classifiers(
+                (self._fit_terms(X, Y[:, batch],
+                                 [hpo_terms[i] for i in batch])
+                 for batch in batches), len(hpo_terms))
+            return
+
+        folder = tempfile.mkdtemp(prefix="flat_")
+        try:
+            # all workers read the same memory-mapped feature matrix
+            X = share_matrix(X, folder)
+            # batches are returned in order as soon as they are fitted
+            self._update_classifiers(
+                Parallel(n_jobs=self._n_jobs, return_as="generator")(
+                    delayed(self._fit_terms)(X, Y[:, batch],
+                                             [hpo_terms[i] for i in batch])
+                    for batch in batches), len(hpo_terms))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def _update_classifiers(self, results, n_terms):
+        """Collect classifiers of batches of HPO terms and report progress.
+        :param results: iterable of dict returned by _fit_terms
+        :param n_terms: number of HPO terms being fitted
+        :return: None
+        """
+        n_fitted = 0
+        for classifiers in results:
+            self._classifiers.update(classifiers)
+            n_fitted += len(classifiers)
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                  "Fit", n_fitted, "/", n_terms, "HPO terms")
+
+    def _fit_terms(self, X, Y, hpo_terms):
+        """Fit classifiers of a batch of HPO terms.
+        :param X: feature matrix, SciPy CSR matrix
+        :param Y: label matrix, numpy array with columns being hpo_terms
+        :param hpo_terms: list of HPO terms
+        :return: dict, key: HPO term, value: fitted classifier
+        """
+        classifiers = dict()
+        for idx, hpo_term in enumerate(hpo_terms):
+            y = Y[:, idx]
             if len(np.unique(y)) == 2:
                 clf = self._get_model()
             else:
                 clf = SameModel()
             clf.fit(X, y)
-            self._classifiers[hpo_term] = clf
-            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-                  "Fit", hpo_term)
+            classifiers[hpo_term] = clf
+        return classifiers
 
-    def predict(self, feature):
+    def predict(self, feature, protein_list=None):
         """Predict scores on each HPO terms according to given features.
-        :param feature: features, DataFrame instance with rows being proteins
-            and columns being HPO terms, the values are real number
+        :param feature: features, DataFrame instance (or SciPy sparse matrix)
+            with rows being proteins and columns being HPO terms, the values
+            are real number
+        :param protein_list: proteins of rows in feature, MUST be given when
+            feature is a sparse matrix
         :return: predictive score, dict like
         { protein1: { term1: score1, term2: score2
         """
-        assert isinstance(feature, pd.DataFrame), \
-            "Argument feature must be Pandas DataFrame instance."
+        assert isinstance(feature, pd.DataFrame) or sparse.issparse(feature), \
+            "Argument feature must be Pandas DataFrame instance or SciPy " \
+            "sparse matrix."
 
         score = defaultdict(dict)
-        protein_list = feature.axes[0].tolist()
+        if protein_list is None:
+            protein_list = feature.axes[0].tolist()
+        X = df_to_csr(feature)
+        if self._multi_label is not None:
+            # scores of all HPO terms by one sparse-dense product
+            prediction = self._multi_label.predict_proba(X)
+            for idx, protein in enumerate(protein_list):
+                score[protein] = dict(zip(self._hpo_terms,
+                                          prediction[idx].tolist()))
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                  "Predict", len(self._hpo_terms), "HPO terms")
+            return score
+
         for hpo_term in self._classifiers:
             clf = self._classifiers[hpo_term]
-            prediction = clf.predict_proba(feature)[:, 1]
+            # float scores, as float32 features give float32 predictions
+            prediction = clf.predict_proba(X)[:, 1].tolist()
             for idx, protein in enumerate(protein_list):
                 score[protein][hpo_term] = prediction[idx]
-            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-                  "Predict", hpo_term)
-
+        print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+              "Predict", len(self._classifiers), "HPO terms")
         return score
 
 
@@ -138,10 +377,12 @@ if __name__ == "__main__":
     ltr_protein_list = load_protein(config["protein_list"]["ltr"])
     test_protein_list = load_protein(config["protein_list"]["test"])
 
-    # load features and convert them to DataFrame
-    feature = load_feature(config["feature"])
-    df_feature = pd.DataFrame.from_dict(feature, orient="index")
-    df_feature = df_feature.fillna(0)
+    # load features as (memory-mapped) sparse matrix
+    feature, feature_proteins, _ = load_feature(config["feature"], as_csr=True)
+    # drop weak edges if the feature is a network
+    if "prune" in config:
+        feature = prune_network(feature, **config["prune"])
+    feature_vocab = Vocabulary(feature_proteins)
 
     combined_ltr_result = defaultdict(dict)
     combined_test_result = defaultdict(dict)
@@ -159,25 +400,27 @@ if __name__ == "__main__":
         df_annotation = df_annotation.fillna(0)
 
         # extract training features and annotations
-        train_protein_of_ns = list(set(train_protein_list) &
-                                   set(df_annotation.axes[0]) &
-                                   set(df_feature.axes[0]))
-        train_feature = df_feature.loc[train_protein_of_ns]
+        train_protein_of_ns, _ = Vocabulary(df_annotation.index).intersect(
+            train_protein_list)
+        train_protein_of_ns, train_rows = feature_vocab.intersect(
+            train_protein_of_ns)
+        train_feature = feature[train_rows]
         train_annotation = df_annotation.loc[train_protein_of_ns]
         # extract ltr training features and annotations
-        ltr_protein_of_ns = list(set(ltr_protein_list) &
-                                 set(df_feature.axes[0]))
-        ltr_feature = df_feature.loc[ltr_protein_of_ns]
+        ltr_protein_of_ns, ltr_rows = feature_vocab.intersect(
+            ltr_protein_list)
+        ltr_feature = feature[ltr_rows]
         # extract test features and annotations
-        test_protein_of_ns = list(set(test_protein_list) &
-                                  set(df_feature.axes[0]))
-        test_feature = df_feature.loc[test_protein_of_ns]
+        test_protein_of_ns, test_rows = feature_vocab.intersect(
+            test_protein_list)
+        test_feature = feature[test_rows]
 
         # train model and predict
-        classifier = FlatModel(model=config["model"])
+        classifier = FlatModel(model=config["model"],
+                               n_jobs=config["n_jobs"])
         classifier.fit(train_feature, train_annotation)
-        ltr_result = classifier.predict(ltr_feature)
-        test_result = classifier.predict(test_feature)
+        ltr_result = classifier.predict(ltr_feature, ltr_protein_of_ns)
+        test_result = classifier.predict(test_feature, test_protein_of_ns)
 
         # combine result into final result
         for protein in ltr_result:
@@ -188,7 +431,5 @@ if __name__ == "__main__":
                 combined_test_result[protein][term] = test_result[protein][term]
 
     # write result
-    with open(config["result"]["ltr"], "w") as fp:
-        json.dump(combined_ltr_result, fp, indent=2)
-    with open(config["result"]["test"], "w") as fp:
-        json.dump(combined_test_result, fp, indent=2)
+    save_result(config["result"]["ltr"], combined_ltr_result)
+    save_result(config["result"]["test"], combined_test_result)
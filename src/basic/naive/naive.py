@@ -8,7 +8,8 @@ S(protein, term) = ----------------------------------------------------------
 import json
 from collections import defaultdict
 from src.utils.ontology import HumanPhenotypeOntology, get_ns_id
-from src.utils.file_reader import load_annotation, load_protein
+from src.utils.file_reader import load_annotation, load_protein, \
+    save_prior_result
 
 
 class Naive:
@@ -44,6 +45,12 @@ class Naive:
             prediction[protein] = self._frequency
         return prediction
 
+    def prior(self):
+        """Return frequency of HPO terms shared by all proteins.
+        :return: dict, like { hpo_term1: score1, hpo_term2: score2, ... }
+        """
+        return dict(self._frequency)
+
 
 if __name__ == "__main__":
     with open("../../../config/basic/naive/naive.json") as fp:
@@ -59,27 +66,17 @@ if __name__ == "__main__":
     ltr_protein_list = load_protein(config["protein_list"]["ltr"])
     test_protein_list = load_protein(config["protein_list"]["test"])
 
-    ltr_result = defaultdict(dict)
-    test_result = defaultdict(dict)
+    # frequency of HPO terms, shared by all proteins
+    prior = dict()
     for ns in ns_id:
         # load propagated HPO annotations of specified sub-ontology
         hpo_annotation = load_annotation(config["annotation"], ontology, ns)
 
         predictor = Naive()
         predictor.fit(hpo_annotation)
-        ltr_predict_result = predictor.predict(ltr_protein_list)
-        test_predict_result = predictor.predict(test_protein_list)
-
-        # combine the prediction
-        for protein in ltr_predict_result:
-            for hpo_term in ltr_predict_result[protein]:
-                ltr_result[protein][hpo_term] = ltr_predict_result[protein][hpo_term]
-        for protein in test_predict_result:
-            for hpo_term in test_predict_result[protein]:
-                test_result[protein][hpo_term] = test_predict_result[protein][hpo_term]
+        # HPO terms of different sub-ontologies are disjoint
+        prior.update(predictor.prior())
 
-    # write into file
-    with open(config["result"]["ltr"], 'w') as fp:
-        json.dump(ltr_result, fp, indent=2)
-    with open(config["result"]["test"], 'w') as fp:
-        json.dump(test_result, fp, indent=2)
+    # write into file, one vector of scores for all proteins
+    save_prior_result(config["result"]["ltr"], prior, ltr_protein_list)
+    save_prior_result(config["result"]["test"], prior, test_protein_list)
@@ -5,16 +5,43 @@
 It propagates HPO terms from neighbors in PPI network.
 """
 import json
-from collections import defaultdict
-from functools import reduce
+import os
+import numpy as np
+from scipy import sparse
 from src.utils.ontology import HumanPhenotypeOntology
-from src.utils.file_reader import load_protein, load_annotation
+from src.utils.file_reader import load_protein, load_annotation, \
+    load_network, save_network, save_result
+from src.utils.matrix import dict_to_csr, csr_to_dict
+from src.utils.network import prune_network
+
+
+def neighbor_scoring_matrix(adjacency, labels):
+    """Scoring function of Neighbor method on matrices.
+
+    The score of a protein on an HPO term is the sum of the edge weights of
+    its neighbours annotated with the term, divided by the sum of the weights
+    of all its neighbours, i.e. the product of the row-normalized adjacency
+    matrix and the annotation matrix.
+    :param adjacency: weighted adjacency matrix of PPI network, SciPy sparse
+        matrix of shape (n_queries, n_proteins), rows are query proteins
+    :param labels: HPO annotations of proteins in the network, SciPy sparse
+        matrix of shape (n_proteins, n_terms), the values are 0/1
+    :return: predictive scores, SciPy CSR matrix of shape (n_queries, n_terms),
+        rows of proteins whose sum of weights is zero are left empty
+    """
+    adjacency = sparse.csr_matrix(adjacency, dtype=np.float64)
+    normalizer = np.asarray(adjacency.sum(axis=1)).reshape(-1)
+    with np.errstate(divide="ignore"):
+        inverse = np.where(normalizer != 0, 1. / normalizer, 0.)
+    adjacency = sparse.diags(inverse) @ adjacency
+    return sparse.csr_matrix(adjacency @ labels)
 
 
 def neighbor_scoring(network, test_proteins, train_annotation):
     """Scoring function of Neighbor method.
     :param network: protein-protein interaction network, like
         { protein1: { protein_a: score1a, ... }, ... }
+        or tuple of adjacency matrix and list of proteins (see load_network)
     :param test_proteins: list of proteins in test set
         [ protein1, protein2, ... ]
     :param train_annotation: HPO annotations of training set
@@ -22,19 +49,63 @@ def neighbor_scoring(network, test_proteins, train_annotation):
     :return: predictive score, like
         { protein1: { hpo_term1: score1, ... }, ... }
     """
-    scores = defaultdict(dict)
-    for protein in test_proteins:
-        if protein in network:
-            hpo_terms = reduce(lambda a, b: a | b,
-                               [set(train_annotation.get(neighbour, set()))
-                                for neighbour in network[protein]])
-            normalizer = sum(network[protein].values())
-            for hpo_term in hpo_terms:
-                scores[protein][hpo_term] = sum(
-                    [(hpo_term in train_annotation.get(neighbour, set())) *
-                     network[protein][neighbour]
-                     for neighbour in network[protein]]) / normalizer
-    return scores
+    if isinstance(network, dict):
+        # all proteins in the network, including the ones only being
+        # neighbours
+        proteins = sorted(set(network) |
+                          set(neighbour for protein in network
+                              for neighbour in network[protein]))
+        test_proteins = [protein for protein in dict.fromkeys(test_proteins)
+                         if protein in network]
+        adjacency, _, _ = dict_to_csr(network, rows=test_proteins,
+                                      columns=proteins)
+    else:
+        adjacency, proteins = network
+        proteins = list(proteins)
+        protein_index = {protein: i for i, protein in enumerate(proteins)}
+        test_proteins = [protein for protein in dict.fromkeys(test_proteins)
+                         if protein in protein_index]
+        adjacency = adjacency[[protein_index[protein]
+                               for protein in test_proteins]]
+    labels, _, hpo_terms = dict_to_csr(train_annotation, rows=proteins)
+    scores = neighbor_scoring_matrix(adjacency, labels)
+    return csr_to_dict(scores, test_proteins, hpo_terms)
+
+
+def add_weight_matrix(adjacency, chunk_size=1024):
+    """Add weight to the edges in the network on sparse matrices.
+
+    Let N(a) be the neighbours of protein a plus a itself, c be the size of
+    N(a) & N(b), the weight of edge (a, b) is
+        2c / (|N(a) - N(b)| + 2c + 1) * 2c / (|N(b) - N(a)| + 2c + 1)
+    where c is given by A*A (A with self-loops) restricted to the edges, and
+    |N(a) - N(b)| = |N(a)| - c.
+    :param adjacency: adjacency matrix of PPI network, SciPy sparse matrix of
+        shape (n_proteins, n_proteins), non-zero entries are edges
+    :param chunk_size: number of rows of A*A computed at a time
+    :return: weighted adjacency matrix, SciPy CSR matrix with the same edges
+    """
+    edges = sparse.csr_matrix(adjacency, dtype=np.float64, copy=True)
+    edges.data[:] = 1
+    edges.eliminate_zeros()
+    # neighbours of each protein plus itself
+    closed = sparse.csr_matrix(edges + sparse.identity(edges.shape[0]))
+    closed.data[:] = 1
+    degree = np.asarray(closed.sum(axis=1)).reshape(-1)
+
+    weighted = list()
+    for start in range(0, edges.shape[0], chunk_size):
+        end = min(start + chunk_size, edges.shape[0])
+        # sizes of common neighbours, only kept on existing edges
+        common = sparse.csr_matrix(
+            (closed[start:end] @ closed).multiply(edges[start:end]))
+        rows = np.repeat(np.arange(start, end), np.diff(common.indptr))
+        cols = common.indices
+        c = common.data
+        common.data = (2 * c / (degree[rows] + c + 1)) * \
+                      (2 * c / (degree[cols] + c + 1))
+        weighted.append(common)
+    return sparse.csr_matrix(sparse.vstack(weighted, format="csr"))
 
 
 def add_weight(network):
@@ -48,32 +119,52 @@ def add_weight(network):
           protein2: { protein2a: score2a, protein2b: score2b, ... },
           ... }
     """
-    ppi = defaultdict(dict)
-    for protein_a in network:
-        neighbour_a = set(network[protein_a].keys()) | {protein_a}
-        for protein_b in network[protein_a]:
-            neighbour_b = set(network[protein_b].keys()) | {protein_b}
-            score = ((2 * len(neighbour_a & neighbour_b)) /
-                     (len(neighbour_a - neighbour_b) +
-                      2 * len(neighbour_a & neighbour_b) + 1)) * \
-                    ((2 * len(neighbour_a & neighbour_b)) /
-                     (len(neighbour_b - neighbour_a) +
-                      2 * len(neighbour_a & neighbour_b) + 1))
-            ppi[protein_a][protein_b] = score
-            ppi[protein_b][protein_a] = score
-    return ppi
+    adjacency, proteins, _ = dict_to_csr(network, columns=sorted(network))
+    return csr_to_dict(add_weight_matrix(adjacency), proteins, proteins)
+
+
+def load_weighted_network(network_path, weighted_path):
+    """Load unweighted PPI network with weights added by add_weight_matrix.
+    The weighted network is cached in weighted_path together with the path of
+    the unweighted network (source.json, saved at last), and it is rebuilt if
+    it is missing, built from another network, or older than the network.
+    :param network_path: path to unweighted network saved by save_network
+    :param weighted_path: path to the cache of weighted network
+    :return: adjacency matrix (SciPy CSR matrix), numpy array of proteins
+    """
+    source = os.path.abspath(network_path)
+    source_path = os.path.join(weighted_path, "source.json")
+    if os.path.exists(source_path) and os.path.getmtime(source_path) >= \
+            os.path.getmtime(os.path.join(network_path, "columns.npy")):
+        with open(source_path) as fp:
+            if json.load(fp) == source:
+                # reuse the network weighted in previous runs
+                return load_network(weighted_path)
+
+    adjacency, proteins = load_network(network_path)
+    network = add_weight_matrix(adjacency), proteins
+    save_network(weighted_path, network)
+    with open(source_path, 'w') as fp:
+        json.dump(source, fp)
+    return network
 
 
 if __name__ == "__main__":
     with open("../../../config/basic/neighbor/neighbor_COXPRESdb.json") as fp:
         config = json.load(fp)
 
-    # load PPI network
-    with open(config["network"]["path"]) as fp:
-        network = json.load(fp)
     # actually customized for BioGRID
     if config["network"]["type"] == "unweighted":
-        network = add_weight(network)
+        network = load_weighted_network(config["network"]["path"],
+                                        config["network"]["weighted"])
+    else:
+        # load PPI network
+        network = load_network(config["network"]["path"])
+    # drop weak edges of the network
+    if "prune" in config["network"]:
+        adjacency, proteins = network
+        network = prune_network(adjacency, **config["network"]["prune"]), \
+            proteins
 
     # load proteins in training set and test set
     ltr_proteins = load_protein(config["protein_list"]["ltr"])
@@ -90,7 +181,5 @@ if __name__ == "__main__":
     test_result = neighbor_scoring(network, test_proteins, train_annotation)
 
     # write into file
-    with open(config["result"]["ltr"], 'w') as fp:
-        json.dump(ltr_result, fp, indent=2)
-    with open(config["result"]["test"], 'w') as fp:
-        json.dump(test_result, fp, indent=2)
+    save_result(config["result"]["ltr"], ltr_result)
+    save_result(config["result"]["test"], test_result)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of bootstrap confidence intervals of evaluation metrics.
+
+The result is evaluated on the test annotation of each sub-ontology. The
+precomputation of Bootstrap and the replicates are timed for each number of
+processes, and a few replicates are recomputed by resampling the score matrix
+explicitly, which gives the runtime of the naive way and checks that both ways
+agree.
+"""
+import json
+import time
+import numpy as np
+from src.utils.ontology import HumanPhenotypeOntology, get_ns_id
+from src.utils.file_reader import load_annotation, load_result_matrix
+from src.utils.matrix import dict_to_csr
+from src.utils.evaluation import Bootstrap, f_max, auroc, aupr, \
+    term_auroc
+
+
+def naive_replicates(result, annotation, n_replicates, random_state=None):
+    """Recompute metrics on explicitly resampled matrices.
+    :param result: predictive scores, numpy array
+    :param annotation: true HPO annotations aligned with result, numpy array
+    :param n_replicates: number of replicates
+    :param random_state: seed of resampling
+    :return: dict, key: metric, value: numpy array of each replicate
+    """
+    rng = np.random.RandomState(random_state)
+    n_rows, n_cols = result.shape
+    values = {"f_max": [], "auroc": [], "aupr": []}
+    for _ in range(n_replicates):
+        rows = rng.randint(n_rows, size=n_rows)
+        cols = rng.randint(n_cols, size=n_cols)
+        values["f_max"].append(f_max(result[rows], annotation[rows])[0])
+        values["auroc"].append(auroc(result[:, cols], annotation[:, cols]))
+        values["aupr"].append(aupr(result[rows], annotation[rows]))
+    return {metric: np.array(value) for metric, value in values.items()}
+
+
+if __name__ == "__main__":
+    with open("../../config/benchmark/bootstrap.json") as fp:
+        config = json.load(fp)
+
+    # load HPO
+    ontology = HumanPhenotypeOntology(config["ontology"]["path"],
+                                      version=config["ontology"]["version"])
+
+    print("ns", "method", "n_jobs", "replicates", "time(s)", "f_max",
+          "auroc", "aupr", sep='\t')
+    for ns in get_ns_id(version=config["ontology"]["version"]):
+        if ns == "freq":
+            continue
+        test_annotation = load_annotation(config["annotation"], ontology,
+                                          ns=ns)
+        truth, proteins, hpo_terms = dict_to_csr(test_annotation)
+        truth = truth.toarray()
+        result, _, _ = load_result_matrix(config["result"],
+                                          proteins=proteins, terms=hpo_terms)
+        result = result.toarray() if hasattr(result, "toarray") else \
+            np.asarray(result)
+
+        start = time.perf_counter()
+        bootstrap = Bootstrap(result, truth)
+        print(ns, "precompute", 1, 0, round(time.perf_counter() - start, 4),
+              sep='\t')
+        for n_jobs in config["n_jobs"]:
+            start = time.perf_counter()
+            replicates = bootstrap.run(config["n_replicates"],
+                                       batch_size=config["batch_size"],
+                                       n_jobs=n_jobs, random_state=0)
+            print(ns, "bootstrap", n_jobs, config["n_replicates"],
+                  round(time.perf_counter() - start, 4),
+                  *[round(replicates[metric].std(), 4)
+                    for metric in ("f_max", "auroc", "aupr")], sep='\t')
+
+        start = time.perf_counter()
+        replicates = naive_replicates(result, truth, config["n_naive"],
+                                      random_state=0)
+        print(ns, "naive", 1, config["n_naive"],
+              round(time.perf_counter() - start, 4),
+              *[round(replicates[metric].std(), 4)
+                for metric in ("f_max", "auroc", "aupr")], sep='\t')
+
+        # the same resampling given as weights must give the same metrics
+        rng = np.random.RandomState(0)
+        rows = rng.randint(result.shape[0], size=result.shape[0])
+        cols = rng.randint(result.shape[1], size=result.shape[1])
+        naive = naive_replicates(result, truth, 1, random_state=0)
+        protein_weights = np.bincount(
+            rows, minlength=result.shape[0])[np.newaxis, :] * 1.
+        # weights of HPO terms having both classes, like Bootstrap
+        term_weights = np.bincount(
+            cols, minlength=result.shape[1])[np.newaxis, :] * 1.
+        term_weights = term_weights[:, ~np.isnan(term_auroc(result, truth))]
+        weighted = {"f_max": bootstrap.f_max(protein_weights),
+                    "auroc": bootstrap.auroc(term_weights),
+                    "aupr": bootstrap.aupr(protein_weights)}
+        print(ns, "check", *["%s %.2e" % (metric, abs(
+            weighted[metric][0] - naive[metric][0])) for metric in weighted],
+            sep='\t')
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of pruning network features.
+
+For each pruning level (see prune_network), the network is pruned and the
+test proteins are scored by Neighbor method. The runtime and peak memory of
+pruning and scoring, the number of edges and F-max/AUPR of the predictions
+on the test annotation are reported.
+"""
+import json
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.utils.ontology import HumanPhenotypeOntology
+from src.utils.file_reader import load_protein, load_annotation, load_network
+from src.utils.matrix import dict_to_csr
+from src.utils.network import prune_network
+from src.utils.evaluation import f_max, aupr
+from src.basic.neighbor.neighbor import neighbor_scoring_matrix
+
+
+def run_level(adjacency, selection, labels, prune):
+    """Prune network and score the test proteins.
+    :param adjacency: adjacency matrix of the network
+    :param selection: SciPy sparse matrix of shape (n_tests, n_proteins),
+        selecting rows of test proteins from adjacency
+    :param labels: HPO annotations of proteins in the network, SciPy sparse
+        matrix of shape (n_proteins, n_terms)
+    :param prune: dict, arguments of prune_network
+    :return: number of edges, runtime in seconds, peak memory in bytes and
+        predictive scores of test proteins
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    pruned = prune_network(adjacency, **prune)
+    scores = neighbor_scoring_matrix(selection @ pruned, labels)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pruned.nnz, elapsed, peak, scores
+
+
+if __name__ == "__main__":
+    with open("../../config/benchmark/network_pruning.json") as fp:
+        config = json.load(fp)
+
+    # load HPO
+    ontology = HumanPhenotypeOntology(config["ontology"]["path"],
+                                      version=config["ontology"]["version"])
+    # load network into memory
+    adjacency, proteins = load_network(config["network"], mmap_mode=None)
+    protein_index = {protein: i for i, protein in enumerate(proteins.tolist())}
+
+    # test annotation, terms not in test set are not evaluated
+    test_annotation = load_annotation(config["annotation"]["test"], ontology)
+    test_proteins = [protein for protein
+                     in load_protein(config["protein_list"]["test"])
+                     if protein in test_annotation]
+    truth, _, hpo_terms = dict_to_csr(test_annotation, rows=test_proteins)
+    truth = pd.DataFrame(truth.toarray(), index=test_proteins,
+                         columns=hpo_terms)
+    # training annotation of proteins in the network
+    train_annotation = load_annotation(config["annotation"]["train"],
+                                       ontology)
+    labels, _, _ = dict_to_csr(train_annotation, rows=proteins.tolist(),
+                               columns=hpo_terms)
+    # test proteins not in the network get empty rows
+    in_network = [(i, protein_index[protein])
+                  for i, protein in enumerate(test_proteins)
+                  if protein in protein_index]
+    selection = sparse.csr_matrix(
+        (np.ones(len(in_network)),
+         ([i for i, _ in in_network], [j for _, j in in_network])),
+        shape=(len(test_proteins), len(proteins)))
+
+    print("prune", "edges", "time(s)", "memory(MB)", "f_max", "aupr",
+          sep='\t')
+    for prune in config["levels"]:
+        n_edges, elapsed, peak, scores = run_level(adjacency, selection,
+                                                   labels, prune)
+        result = pd.DataFrame(scores.toarray(), index=test_proteins,
+                              columns=hpo_terms)
+        f_max_value, _ = f_max(result, truth)
+        print(json.dumps(prune), n_edges, round(elapsed, 4),
+              round(peak / 2 ** 20, 2), round(f_max_value, 4),
+              round(aupr(result, truth), 4), sep='\t')
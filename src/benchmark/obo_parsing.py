@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark of reading obo files by GODag and FastGODag.
+
+Each obo file is read by both parsers for several times, the best wall time
+is reported, and the parents (is_a and part_of) of terms are checked to be
+the same.
+"""
+import json
+import time
+from src.utils.obo_parser import GODag, FastGODag
+
+
+def get_parents(go_dag):
+    """Return is_a and part_of parents of each term.
+    :param go_dag: GODag or FastGODag
+    :return: dict, key: term id, value: (set of is_a, set of part_of)
+    """
+    parents = dict()
+    for term_id, term in go_dag.items():
+        part_of = set()
+        if hasattr(term, 'relationship'):
+            part_of = set(p.id for p in term.relationship.get('part_of', ()))
+        parents[term_id] = (set(p.id for p in term.parents), part_of)
+    return parents
+
+
+def time_parser(parser, obo_file_path, repeat):
+    """Return the best wall time of reading obo file and the parsed result.
+    :param parser: function reading obo file
+    :param obo_file_path: path to obo file
+    :param repeat: times of reading
+    :return: best time in seconds, parsed result
+    """
+    best, go_dag = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        go_dag = parser(obo_file_path)
+        best = min(best, time.perf_counter() - start)
+    return best, go_dag
+
+
+if __name__ == "__main__":
+    with open("../../config/benchmark/obo_parsing.json") as fp:
+        config = json.load(fp)
+
+    for obo_file_path in config["obo"]:
+        godag_time, go_dag = time_parser(
+            lambda path: GODag(path, 'relationship'),
+            obo_file_path, config["repeat"])
+        fast_time, fast_dag = time_parser(FastGODag, obo_file_path,
+                                          config["repeat"])
+        same = (get_parents(go_dag) == get_parents(fast_dag) and
+                dict(go_dag.alt_ids) == dict(fast_dag.alt_ids))
+        print("%s\tGODag: %.3fs\tFastGODag: %.3fs\tspeedup: %.1fx\tsame: %s"
+              % (obo_file_path, godag_time, fast_time,
+                 godag_time / fast_time, same))
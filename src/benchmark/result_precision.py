@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Regression check of result stores against json results.
+
+Scores of json results are float64. Each result is saved by save_result (both
+dense and sparse stores) and save_prior_result, loaded back, and F-max, AUROC
+and AUPR are compared with the ones calculated on the json scores, which must
+be the same. Besides the json results in config, a synthetic result of exact
+decimals (k/100) and ratios (k/20, as Neighbor and Naive give) is checked,
+since these are the scores moved across thresholds by rounding.
+"""
+import json
+import os
+import tempfile
+import numpy as np
+from src.utils.ontology import HumanPhenotypeOntology
+from src.utils.file_reader import load_annotation, load_result, \
+    load_result_matrix, save_result, save_prior_result
+from src.utils.matrix import dict_to_csr
+from src.utils.evaluation import f_max, auroc, aupr
+
+
+def metrics_of(result, truth):
+    """Calculate F-max, threshold, AUROC and AUPR.
+    :param result: predictive scores aligned with truth
+    :param truth: true HPO annotations, numpy array (0: no, 1: yes)
+    :return: tuple of metrics
+    """
+    f_max_value, threshold = f_max(result, truth)
+    return f_max_value, threshold, auroc(result, truth), aupr(result, truth)
+
+
+def check(name, result, proteins, terms, truth):
+    """Compare metrics of json scores and of scores loaded from stores.
+    :param name: name of the result shown in output
+    :param result: dict, json scores like
+        { protein1: { hpo_term1: score1, ... }, ... }
+    :param proteins: list of proteins, rows of truth
+    :param terms: list of HPO terms, columns of truth
+    :param truth: true HPO annotations, numpy array
+    :return: True if all metrics are the same
+    """
+    expected = metrics_of(dict_to_csr(result, rows=proteins,
+                                      columns=terms)[0], truth)
+    same = True
+    with tempfile.TemporaryDirectory() as folder:
+        for dense in (True, False):
+            path = os.path.join(folder, "dense" if dense else "sparse")
+            save_result(path, result, dense=dense)
+            scores, _, _ = load_result_matrix(path, proteins, terms)
+            actual = metrics_of(scores, truth)
+            print(name, path.split(os.sep)[-1], *np.round(actual, 4),
+                  actual == expected, sep='\t')
+            same &= actual == expected
+    return same
+
+
+if __name__ == "__main__":
+    with open("../../config/benchmark/result_precision.json") as fp:
+        config = json.load(fp)
+
+    print("result", "store", "f_max", "threshold", "auroc", "aupr", "same",
+          sep='\t')
+    passed = True
+
+    # synthetic result of exact decimals and ratios
+    rng = np.random.RandomState(0)
+    n_proteins, n_terms = 200, 100
+    proteins = ["P%d" % i for i in range(n_proteins)]
+    terms = ["HP:%07d" % j for j in range(n_terms)]
+    truth = (rng.rand(n_proteins, n_terms) < 0.1).astype(np.float64)
+    for name, scores in (("decimal", rng.randint(0, 101, truth.shape) / 100),
+                         ("ratio", rng.randint(0, 21, truth.shape) / 20)):
+        result = {protein: {term: scores[i, j]
+                            for j, term in enumerate(terms) if scores[i, j]}
+                  for i, protein in enumerate(proteins)}
+        passed &= check(name, result, proteins, terms, truth)
+    # scores shared by all proteins
+    prior = dict(zip(terms, rng.randint(1, 10, n_terms) / 10))
+    expected = metrics_of(np.tile([prior[term] for term in terms],
+                                  (n_proteins, 1)), truth)
+    with tempfile.TemporaryDirectory() as folder:
+        save_prior_result(folder, prior, proteins)
+        actual = metrics_of(load_result_matrix(folder, proteins, terms)[0],
+                            truth)
+    print("prior", "prior", *np.round(actual, 4), actual == expected,
+          sep='\t')
+    passed &= actual == expected
+
+    # json results of the pipeline
+    ontology = HumanPhenotypeOntology(config["ontology"]["path"],
+                                      version=config["ontology"]["version"])
+    test_annotation = load_annotation(config["annotation"], ontology)
+    truth, proteins, terms = dict_to_csr(test_annotation)
+    for file_path in config["result"]:
+        passed &= check(os.path.basename(file_path), load_result(file_path),
+                        proteins, terms, truth.toarray())
+
+    assert passed, "Metrics of result stores differ from json results."
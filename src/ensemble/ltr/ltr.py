@@ -1,5 +1,260 @@
-# Due to requirements of my mentor, 
-# this part of core code is not public now.
-# For more details, please email me:
-#   liulizhi1996@gmail.com
-# Sorry!
\ No newline at end of file
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Learning to rank: combine predictive scores of base models by XGBoost.
+
+For each sub-ontology, the candidate HPO terms of a protein are the union of
+the top k HPO terms of each base model. Each (protein, candidate) pair is an
+instance whose features are the scores of base models, and the candidates of
+a protein form a query group. A ranking model (e.g. rank:pairwise) is trained
+on proteins of ltr set, and its outputs on test proteins are mapped into
+[0, 1] by sigmoid function.
+"""
+import json
+import time
+import numpy as np
+from scipy import sparse
+from scipy.special import expit
+import pandas as pd
+import xgboost as xgb
+from src.utils.ontology import HumanPhenotypeOntology, get_ns_id
+from src.utils.file_reader import load_protein, load_annotation, \
+    load_result_matrix, save_result
+from src.utils.matrix import dict_to_csr
+
+
+def top_k_mask(scores, k):
+    """Mark the top k non-zero scores of each row.
+    :param scores: numpy array or SciPy sparse matrix of shape
+        (n_proteins, n_terms)
+    :param k: number of HPO terms kept for each protein
+    :return: SciPy CSR matrix of bool, True for kept scores
+    """
+    if not sparse.issparse(scores):
+        scores = np.asarray(scores)
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return sparse.csr_matrix(scores.shape, dtype=bool)
+        cols = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        rows = np.repeat(np.arange(scores.shape[0]), k)
+        cols = cols.reshape(-1)
+        keep = scores[rows, cols] > 0
+        return sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype=bool), (rows[keep], cols[keep])),
+            shape=scores.shape)
+
+    scores = sparse.csr_matrix(scores)
+    # rank of each score among scores of the same row, highest first
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    order = np.lexsort((-scores.data, rows))
+    rank = np.empty(scores.nnz, dtype=np.int64)
+    rank[order] = np.arange(scores.nnz) - scores.indptr[rows[order]]
+    keep = (rank < k) & (scores.data > 0)
+    return sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=bool),
+         (rows[keep], scores.indices[keep])), shape=scores.shape)
+
+
+def generate_candidates(score_list, k):
+    """Candidate HPO terms of each protein, i.e. the union of the top k HPO
+    terms of each base model.
+    :param score_list: list of scores of base models, numpy arrays or SciPy
+        sparse matrices of the same shape (n_proteins, n_terms)
+    :param k: number of HPO terms taken from each base model
+    :return: numpy arrays of rows and columns of candidates, sorted by rows
+        (so candidates of a protein are contiguous)
+    """
+    candidates = sparse.csr_matrix(score_list[0].shape, dtype=bool)
+    for scores in score_list:
+        candidates = candidates + top_k_mask(scores, k)
+    candidates = candidates.tocoo()
+    order = np.lexsort((candidates.col, candidates.row))
+    return candidates.row[order], candidates.col[order]
+
+
+def gather_scores(score_list, rows, cols):
+    """Build feature matrix of candidates, one column per base model.
+    :param score_list: list of scores of base models, numpy arrays or SciPy
+        sparse matrices of the same shape (n_proteins, n_terms)
+    :param rows: numpy array of rows of candidates
+    :param cols: numpy array of columns of candidates
+    :return: numpy array of float32 of shape (n_candidates, n_models)
+    """
+    features = np.zeros((len(rows), len(score_list)), dtype=np.float32)
+    for j, scores in enumerate(score_list):
+        if sparse.issparse(scores):
+            features[:, j] = np.asarray(
+                sparse.csr_matrix(scores)[rows, cols]).reshape(-1)
+        else:
+            features[:, j] = scores[rows, cols]
+    return features
+
+
+def get_groups(rows):
+    """Sizes of query groups, i.e. the number of candidates of each protein.
+    :param rows: numpy array of rows of candidates, sorted
+    :return: numpy array of group sizes of proteins having candidates
+    """
+    sizes = np.bincount(rows)
+    return sizes[sizes > 0]
+
+
+class LTRModel:
+    """Ranking model trained by XGBoost with query groups.
+
+    Attributes:
+        - model_param: parameters of booster, e.g. objective, max_depth
+        - fit_param: parameters of training, i.e. num_boost_round and
+            early_stopping_rounds
+        - valid_ratio: ratio of query groups held out for early stopping
+        - random_state: seed of the split of query groups
+        - booster: trained xgboost.Booster
+    """
+    def __init__(self, model_param, fit_param, valid_ratio=0.1,
+                 random_state=None):
+        self.model_param = model_param
+        self.fit_param = fit_param
+        self.valid_ratio = valid_ratio
+        self.random_state = random_state
+        self.booster = None
+
+    def fit(self, features, labels, groups):
+        """Train ranking model.
+        :param features: numpy array of shape (n_instances, n_features),
+            instances of a query group are contiguous
+        :param labels: numpy array of relevance (0/1) of instances
+        :param groups: numpy array of sizes of query groups
+        :return: None
+        """
+        # hold out whole query groups for early stopping
+        rng = np.random.RandomState(self.random_state)
+        is_valid = rng.rand(len(groups)) < self.valid_ratio
+        if is_valid.all() or not is_valid.any():
+            is_valid[:] = False
+        instance_valid = np.repeat(is_valid, groups)
+
+        train = xgb.DMatrix(features[~instance_valid],
+                            label=labels[~instance_valid])
+        train.set_group(groups[~is_valid])
+        evals = [(train, "train")]
+        fit_param = dict(self.fit_param)
+        if is_valid.any():
+            valid = xgb.DMatrix(features[instance_valid],
+                                label=labels[instance_valid])
+            valid.set_group(groups[is_valid])
+            evals.append((valid, "valid"))
+        else:
+            fit_param.pop("early_stopping_rounds", None)
+        self.booster = xgb.train(self.model_param, train, evals=evals,
+                                 verbose_eval=False, **fit_param)
+
+    def predict(self, features):
+        """Predict scores of instances.
+        :param features: numpy array of shape (n_instances, n_features)
+        :return: numpy array of scores in [0, 1]
+        """
+        if len(features) == 0:
+            return np.zeros(0)
+        best_iteration = getattr(self.booster, "best_iteration", None)
+        iteration_range = (0, best_iteration + 1) \
+            if best_iteration is not None else (0, 0)
+        margin = self.booster.predict(xgb.DMatrix(features),
+                                      iteration_range=iteration_range)
+        return expit(margin)
+
+
+if __name__ == "__main__":
+    with open("../../../config/ensemble/ltr/ltr.json") as fp:
+        config = json.load(fp)
+
+    # load HPO
+    ontology = HumanPhenotypeOntology(config["ontology"]["path"],
+                                      version=config["ontology"]["version"])
+    # get namespace id list
+    ns_id = get_ns_id(version=config["ontology"]["version"])
+
+    # load ltr training set and test set
+    ltr_protein_list = load_protein(config["protein_list"]["ltr"])
+    test_protein_list = load_protein(config["protein_list"]["test"])
+
+    # HPO terms predicted by any base model
+    hpo_terms = dict()
+    for file_path in config["result"]["ltr"] + config["result"]["test"]:
+        _, _, columns = load_result_matrix(file_path)
+        hpo_terms.update(dict.fromkeys(columns.tolist()))
+
+    timing = dict()
+    test_rows, test_cols, test_scores, test_terms = [], [], [], []
+    for ns in ns_id:
+        if ns not in config["top"]:
+            continue
+        # HPO terms of the sub-ontology, in the same order for all models
+        terms_of_ns = [term for term in hpo_terms
+                       if term in ontology and ontology[term].ns == ns]
+
+        # candidates and their features
+        start = time.perf_counter()
+        ltr_score_list = [load_result_matrix(file_path, ltr_protein_list,
+                                             terms_of_ns)[0]
+                          for file_path in config["result"]["ltr"]]
+        ltr_rows, ltr_cols = generate_candidates(ltr_score_list,
+                                                 config["top"][ns])
+        ltr_features = gather_scores(ltr_score_list, ltr_rows, ltr_cols)
+        test_score_list = [load_result_matrix(file_path, test_protein_list,
+                                              terms_of_ns)[0]
+                           for file_path in config["result"]["test"]]
+        rows, cols = generate_candidates(test_score_list, config["top"][ns])
+        test_features = gather_scores(test_score_list, rows, cols)
+        candidate_time = time.perf_counter() - start
+
+        # labels of ltr candidates
+        ltr_annotation = load_annotation(config["annotation"]["ltr"],
+                                         ontology, ns)
+        labels, _, _ = dict_to_csr(ltr_annotation, rows=ltr_protein_list,
+                                   columns=terms_of_ns, dtype=np.float32)
+        ltr_labels = np.asarray(labels[ltr_rows, ltr_cols]).reshape(-1)
+        # proteins without any positive candidate make no pairs
+        has_positive = np.bincount(ltr_rows, weights=ltr_labels,
+                                   minlength=len(ltr_protein_list)) > 0
+        keep = has_positive[ltr_rows]
+        if not keep.any():
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                  "Skip", ns, "as no ltr protein has positive candidates,",
+                  "try larger top k")
+            continue
+
+        # train ranking model
+        start = time.perf_counter()
+        model = LTRModel(config["model_param"], config["fit_param"],
+                         valid_ratio=config.get("valid_ratio", 0.1),
+                         random_state=config.get("random_state"))
+        model.fit(ltr_features[keep], ltr_labels[keep],
+                  get_groups(ltr_rows[keep]))
+        train_time = time.perf_counter() - start
+
+        # predict scores of test candidates
+        start = time.perf_counter()
+        test_scores.append(model.predict(test_features))
+        predict_time = time.perf_counter() - start
+
+        # HPO terms of different sub-ontologies are disjoint
+        test_rows.append(rows)
+        test_cols.append(cols + len(test_terms))
+        test_terms.extend(terms_of_ns)
+        timing[ns] = {"ltr_instances": keep.sum(),
+                      "test_instances": len(rows),
+                      "candidate": candidate_time, "train": train_time,
+                      "predict": predict_time}
+
+    # write result
+    prediction = sparse.csr_matrix(
+        (np.concatenate(test_scores + [np.zeros(0)]),
+         (np.concatenate(test_rows + [np.zeros(0, dtype=int)]),
+          np.concatenate(test_cols + [np.zeros(0, dtype=int)]))),
+        shape=(len(test_protein_list), len(test_terms)))
+    save_result(config["prediction"], prediction, test_protein_list,
+                test_terms)
+
+    # write number of instances and runtime (in seconds) of each stage
+    if "timing" in config:
+        pd.DataFrame.from_dict(timing, orient="index").to_csv(
+            config["timing"])
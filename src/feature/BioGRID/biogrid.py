@@ -11,7 +11,8 @@ Meanwhile, the identifier mapping file can be downloaded from
 But there are no guarantees of version here.
 """
 import json
-from collections import defaultdict
+from src.utils.file_reader import save_network
+from src.utils.network import load_edge_list
 
 
 def biogrid2uniprot(file_path):
@@ -33,38 +34,24 @@ def biogrid2uniprot(file_path):
     return mapping
 
 
-def get_biogrid_network(path_to_network, path_to_mapping):
+def get_biogrid_network(path_to_network, path_to_mapping, n_jobs=1):
     """Construct BioGRID PPI network.
-    :param path_to_network: path to BioGRID network data
+    :param path_to_network: path to BioGRID network data (or its .gz file)
         You can open https://downloads.thebiogrid.org/BioGRID/Release-Archive
         and choose a directory you want and download file with the extension
         ".tab2" with "ALL" sources
     :param path_to_mapping: path to mapping file provided by BioGRID website
-    :return: dict, PPI network
-        { protein1: { protein1a: score1a, protein1b: score1b, ... },
-          protein2: { protein2a: score2a, protein2b: score2b, ... },
-          ... }
+    :param n_jobs: number of processes mapping the network data
+    :return: PPI network, tuple of adjacency matrix (SciPy CSR matrix) and
+        list of proteins
     """
-    network = defaultdict(dict)
     mapping = biogrid2uniprot(path_to_mapping)
-    with open(path_to_network) as fp:
-        for line in fp:
-            if line.startswith('#'):
-                continue
-            entries = line.strip().split('\t')
-            biogrid_a, biogrid_b = entries[3], entries[4]
-            organism_a, organism_b = entries[15], entries[16]
-            if organism_a != '9606' or organism_b != '9606':    # not human's
-                continue
-            try:  # if no matched accession found, pass it
-                protein_a = mapping[biogrid_a]
-                protein_b = mapping[biogrid_b]
-            except KeyError:
-                continue
-            # BioGRID interaction doesn't provide confidence score (mostly),
-            # so we construct unweighted graph here
-            network[protein_a][protein_b] = network[protein_b][protein_a] = 1
-    return network
+    # skip the header line and interactions not between human's proteins
+    # BioGRID interaction doesn't provide confidence score (mostly),
+    # so we construct unweighted graph here
+    return load_edge_list(path_to_network, (3, 4), mapping,
+                          filters={15: '9606', 16: '9606'}, header=1,
+                          n_jobs=n_jobs)
 
 
 if __name__ == "__main__":
@@ -72,7 +59,7 @@ if __name__ == "__main__":
         config = json.load(fp)
 
     # get PPI network
-    network = get_biogrid_network(config["network"], config["mapping"])
+    network = get_biogrid_network(config["network"], config["mapping"],
+                                  n_jobs=config["n_jobs"])
     # write into file
-    with open(config["feature"], 'w') as fp:
-        json.dump(network, fp, indent=2)
+    save_network(config["feature"], network)
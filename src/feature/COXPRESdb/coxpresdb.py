@@ -11,7 +11,10 @@ Besides, please download Entrez GeneID to UniProt Protein ID mapping file from
 import json
 import zipfile
 from collections import defaultdict
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from src.utils.file_reader import save_network
 
 
 def get_entrez_mapping(path_to_file):
@@ -38,46 +41,122 @@ def get_entrez_mapping(path_to_file):
     return entrez2uniprot
 
 
-def get_co_expression(path_to_file, entrez2uniprot):
+def merge_min_rank(columns, ranks):
+    """Drop duplicate columns of a row, keeping the smallest rank of each.
+    :param columns: numpy array of columns
+    :param ranks: numpy array of ranks of columns
+    :return: numpy arrays of sorted unique columns and their ranks
+    """
+    order = np.lexsort((ranks, columns))
+    columns, ranks = columns[order], ranks[order]
+    first = np.ones(len(columns), dtype=bool)
+    first[1:] = columns[1:] != columns[:-1]
+    return columns[first], ranks[first]
+
+
+def get_co_expression(path_to_file, entrez2uniprot, top_k=None):
     """Calculate proteins' similarity with respect to Co-expression.
+
+    The similarity of proteins a and b is 1 - rank / max_rank, where rank is
+    the smallest rank of the genes of b among the co-expressed genes of the
+    genes of a. Pairs not listed (or not in top k) are left out of the sparse
+    matrix, i.e. their similarity is 0.
     :param path_to_file: path to the COXPRESdb .zip file. You can download
         .zip file from https://coxpresdb.jp/download/ with "Method" being "R".
     :param entrez2uniprot: dict, map from Entrez GeneID to UniProt Protein ID,
         like { gene1: { protein1a, protein1b, ... }, ... }
-    :return: dict, similarity of proteins, like
-        { protein1: { protein1a: score1a, protein1b, score1b, ... }, ... }
+    :param top_k: keep only top k co-expressed genes (with the smallest
+        ranks) of each gene, None means keeping all, which takes memory of
+        the dense matrix of all pairs
+    :return: SciPy CSR matrix of similarity (row: protein_a, column:
+        protein_b), list of proteins (rows and columns of the matrix)
     """
-    ranks = defaultdict(dict)
+    # map from gene (index) to proteins (indices) in CSR layout
+    genes = pd.Index(sorted(entrez2uniprot))
+    proteins = sorted(set(protein for gene in genes
+                          for protein in entrez2uniprot[gene]))
+    protein_index = {protein: i for i, protein in enumerate(proteins)}
+    gene_proteins = [sorted(protein_index[protein]
+                            for protein in entrez2uniprot[gene])
+                     for gene in genes]
+    gene_ptr = np.cumsum([0] + [len(p) for p in gene_proteins])
+    gene_proteins = np.array([p for ps in gene_proteins for p in ps],
+                             dtype=np.int32)
+
+    # deduplicated (columns, ranks) of each row, proteins of the same gene
+    # share the arrays
+    row_blocks = dict()
+    max_rank = 0.
     # open the .zip file
     with zipfile.ZipFile(path_to_file) as fp:
         # traverse each compressed file in the .zip file
         for filename in fp.namelist():
-            # read the file
-            text = fp.read(filename).decode('ascii').strip()
-            # pass the directory (not file)
-            if len(text) == 0:
-                continue
             # extract Entrez GeneID from the filename
             gene_a = filename.split('/')[-1]
-            # skip the gene without mapped protein
+            # skip the directory and the gene without mapped protein
             if gene_a not in entrez2uniprot:
                 continue
-            # parse each line of the file
-            lines = text.split('\n')
-            for line in lines:
-                gene_b, score = line.split('\t')
-                for protein_b in entrez2uniprot[gene_b]:
-                    for protein_a in entrez2uniprot[gene_a]:
-                        ranks[protein_a][protein_b] = float(score)
-    # transform the dict to DataFrame
-    df_ranks = pd.DataFrame.from_dict(ranks).fillna(0)
+            # read the file, each line is "gene_b\trank"
+            entries = fp.read(filename).decode('ascii').split()
+            if len(entries) == 0:
+                continue
+            gene_b = genes.get_indexer(entries[0::2])
+            rank = np.array(entries[1::2], dtype=np.float32)
+            del entries
+            # skip genes without mapped protein
+            mapped = gene_b >= 0
+            gene_b, rank = gene_b[mapped], rank[mapped]
+            if len(rank) == 0:
+                continue
+            max_rank = max(max_rank, float(rank.max()))
+            if top_k is not None and len(rank) > top_k:
+                top = np.argpartition(rank, top_k - 1)[:top_k]
+                gene_b, rank = gene_b[top], rank[top]
+            # expand genes to their proteins
+            counts = gene_ptr[gene_b + 1] - gene_ptr[gene_b]
+            offsets = np.arange(counts.sum()) - \
+                np.repeat(np.cumsum(counts) - counts, counts)
+            block = merge_min_rank(
+                gene_proteins[np.repeat(gene_ptr[gene_b], counts) + offsets],
+                np.repeat(rank, counts))
+            for protein_a in entrez2uniprot[gene_a]:
+                row = protein_index[protein_a]
+                if row in row_blocks:
+                    # protein shared by several genes keeps the best rank
+                    row_blocks[row] = merge_min_rank(
+                        *[np.concatenate(arrays) for arrays in
+                          zip(row_blocks[row], block)])
+                else:
+                    row_blocks[row] = block
+
+    # keep proteins having co-expressed proteins only
+    used = np.zeros(len(proteins), dtype=bool)
+    used[list(row_blocks)] = True
+    for columns, _ in row_blocks.values():
+        used[columns] = True
+    new_index = np.cumsum(used) - 1
+    indptr = np.zeros(used.sum() + 1, dtype=np.int64)
+    for row, (columns, _) in row_blocks.items():
+        indptr[new_index[row] + 1] = len(columns)
+    indptr = np.cumsum(indptr)
+
+    # fill CSR arrays row by row, releasing the blocks
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data = np.empty(indptr[-1], dtype=np.float32)
+    for row in list(row_blocks):
+        columns, ranks = row_blocks.pop(row)
+        start, end = indptr[new_index[row]], indptr[new_index[row] + 1]
+        indices[start:end] = new_index[columns]
+        data[start:end] = ranks
     # normalize the score and convert it to the similarity
     # the closer the score is to 1, the more similar the two proteins are
-    df_scores = pd.DataFrame(1 - df_ranks.values / df_ranks.values.max(),
-                             columns=df_ranks.columns, index=df_ranks.index)
-    # back to dict
-    scores = df_scores.to_dict()
-    return scores
+    if max_rank > 0:
+        data /= max_rank
+    np.subtract(1, data, out=data)
+    similarity = sparse.csr_matrix((data, indices, indptr),
+                                   shape=(len(indptr) - 1, len(indptr) - 1))
+    return similarity, [protein for protein, is_used in zip(proteins, used)
+                        if is_used]
 
 
 if __name__ == "__main__":
@@ -87,7 +166,7 @@ if __name__ == "__main__":
     # get Entrez GeneID to UniProt Protein ID mapping
     gene_mapping = get_entrez_mapping(config["entrez-uniprot"])
     # get Co-expression correlation scores
-    coexp = get_co_expression(config["co-expression"], gene_mapping)
+    coexp = get_co_expression(config["co-expression"], gene_mapping,
+                              top_k=config["top_k"])
     # write into file
-    with open(config["output"], 'w') as fp:
-        json.dump(coexp, fp, indent=2)
+    save_network(config["output"], coexp)
@@ -98,7 +98,7 @@ if __name__ == "__main__":
     # load GOA annotation
     goa_annotation = goa(config["goa"])
     # load GO
-    ontology = GeneOntology(config["ontology"])
+    ontology = GeneOntology(config["ontology"], fast=True)
     for ns in get_ns_id():
         # propagate annotations
         full_annotation = propagate_go_annotation(goa_annotation, ontology,
@@ -9,7 +9,8 @@ and combined network data in
     COMBINED.DEFAULT_NETWORKS.BP_COMBINING.txt
 """
 import json
-from collections import defaultdict
+from src.utils.file_reader import save_network
+from src.utils.network import load_edge_list, prune_network
 
 
 def ensembl2uniprot(file_path):
@@ -30,30 +31,19 @@ def ensembl2uniprot(file_path):
     return mapping
 
 
-def get_genemania_network(path_to_network, path_to_mapping):
+def get_genemania_network(path_to_network, path_to_mapping, n_jobs=1):
     """Construct GeneMANIA PPI network.
-    :param path_to_network: path to combined GeneMANIA network data
+    :param path_to_network: path to combined GeneMANIA network data (or its
+        .gz file)
     :param path_to_mapping: path to identifier mapping file
-    :return: dict, PPI network
-        { protein1: { protein1a: score1a, protein1b: score1b, ... },
-          protein2: { protein2a: score2a, protein2b: score2b, ... },
-          ... }
+    :param n_jobs: number of processes mapping the network data
+    :return: PPI network, tuple of adjacency matrix (SciPy CSR matrix) and
+        list of proteins
     """
-    network = defaultdict(dict)
     mapping = ensembl2uniprot(path_to_mapping)
-    with open(path_to_network) as fp:
-        for line in fp:
-            if line.startswith("Gene_A"):
-                continue
-            gene1, gene2, score = line.strip().split()
-            try:    # if no matched accession found, pass it
-                protein1 = mapping[gene1]
-                protein2 = mapping[gene2]
-            except KeyError:
-                continue
-            score = float(score)
-            network[protein1][protein2] = network[protein2][protein1] = score
-    return network
+    # skip the header line
+    return load_edge_list(path_to_network, (0, 1), mapping, score_column=2,
+                          sep=r"\s+", header=1, n_jobs=n_jobs)
 
 
 if __name__ == "__main__":
@@ -61,7 +51,10 @@ if __name__ == "__main__":
         config = json.load(fp)
 
     # get PPI network
-    network = get_genemania_network(config["network"], config["mapping"])
+    network = get_genemania_network(config["network"], config["mapping"],
+                                    n_jobs=config["n_jobs"])
+    # drop weak edges
+    adjacency, proteins = network
+    network = prune_network(adjacency, **config["prune"]), proteins
     # write into file
-    with open(config["feature"], 'w') as fp:
-        json.dump(network, fp, indent=2)
+    save_network(config["feature"], network)
@@ -9,7 +9,8 @@ Then download UniProt Entry name to ID mapping file from
     https://www.uniprot.org/mapping/
 """
 import json
-from collections import defaultdict
+from src.utils.file_reader import save_network
+from src.utils.network import load_edge_list
 
 
 def get_mapping(path_to_file):
@@ -28,23 +29,16 @@ def get_mapping(path_to_file):
     return name2id
 
 
-def get_network(path_to_file, name2id):
+def get_network(path_to_file, name2id, n_jobs=1):
     """Construct PPI network.
-    :param path_to_file: path to the PPI data set
+    :param path_to_file: path to the PPI data set (or its .gz file)
     :param name2id: dict, mapping from UniProt Entry name to ID
-    :return: nested dict containing PPI scores, like
-        { protein1: { protein1a: score1a, protein1b: score1b, ... }, ... }
+    :param n_jobs: number of processes mapping the PPI data set
+    :return: PPI network, tuple of adjacency matrix (SciPy CSR matrix) and
+        list of proteins
     """
-    interaction = defaultdict(dict)
-    with open(path_to_file) as fp:
-        for line in fp:
-            entries = line.strip().split('\t')
-            name1, name2, score = entries[0], entries[2], entries[4]
-            if name1 in name2id and name2 in name2id:
-                protein1, protein2 = name2id[name1], name2id[name2]
-                interaction[protein1][protein2] = float(score)
-                interaction[protein2][protein1] = float(score)
-    return interaction
+    return load_edge_list(path_to_file, (0, 2), name2id, score_column=4,
+                          n_jobs=n_jobs)
 
 
 if __name__ == "__main__":
@@ -54,7 +48,7 @@ if __name__ == "__main__":
     # get UniProt name to ID mapping
     mapping = get_mapping(config["mapping"])
     # get PPI network
-    network = get_network(config["network"], mapping)
+    network = get_network(config["network"], mapping,
+                          n_jobs=config["n_jobs"])
     # write into file
-    with open(config["output"], 'w') as fp:
-        json.dump(network, fp, indent=2)
+    save_network(config["output"], network)
@@ -9,6 +9,8 @@ and download Entrez GeneID to UniProt Protein ID mapping file from
 """
 import json
 from collections import defaultdict
+from src.utils.file_reader import save_network
+from src.utils.network import load_edge_list, prune_network
 
 
 def get_entrez_mapping(path_to_file):
@@ -35,26 +37,18 @@ def get_entrez_mapping(path_to_file):
     return entrez2uniprot
 
 
-def get_network(path_to_file, entrez2uniprot):
+def get_network(path_to_file, entrez2uniprot, n_jobs=1):
     """Construct HumanNet.
-    :param path_to_file: path to the HumanNet-XN file, see
+    :param path_to_file: path to the HumanNet-XN file (or its .gz file), see
         https://www.inetbio.org/humannet/download.php
-    :param entrez2uniprot: nested dict, like
-        { protein1: { protein1a: score1a, protein1b: score1b, ... }, ... }
-    :return:
+    :param entrez2uniprot: dict, key: Entrez GeneID, value: set of UniProt
+        Protein IDs
+    :param n_jobs: number of processes mapping the network data
+    :return: PPI network, tuple of adjacency matrix (SciPy CSR matrix) and
+        list of proteins
     """
-    network = defaultdict(dict)
-    with open(path_to_file) as fp:
-        for line in fp:
-            if line.startswith('#'):
-                continue
-            gene_a, gene_b, score = line.strip().split('\t')
-            if gene_a in entrez2uniprot and gene_b in entrez2uniprot:
-                for protein_a in entrez2uniprot[gene_a]:
-                    for protein_b in entrez2uniprot[gene_b]:
-                        network[protein_a][protein_b] = float(score)
-                        network[protein_b][protein_a] = float(score)
-    return network
+    return load_edge_list(path_to_file, (0, 1), entrez2uniprot,
+                          score_column=2, comment='#', n_jobs=n_jobs)
 
 
 if __name__ == "__main__":
@@ -64,7 +58,10 @@ if __name__ == "__main__":
     # get Entrez GeneID to UniProt Protein ID mapping
     gene_mapping = get_entrez_mapping(config["entrez-uniprot"])
     # get network
-    humannet = get_network(config["network"], gene_mapping)
+    humannet = get_network(config["network"], gene_mapping,
+                           n_jobs=config["n_jobs"])
+    # drop weak edges
+    adjacency, proteins = humannet
+    humannet = prune_network(adjacency, **config["prune"]), proteins
     # write into file
-    with open(config["output"], 'w') as fp:
-        json.dump(humannet, fp, indent=2)
+    save_network(config["output"], humannet)
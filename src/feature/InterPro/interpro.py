@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""Parse the output xml InterPro matches file.
+"""Parse the output xml (or tsv) InterPro matches file.
 
 Please read https://github.com/ebi-pf-team/interproscan/wiki/HowToRun
 to understand the way to run InterProScan:
@@ -10,45 +10,144 @@ https://github.com/ebi-pf-team/interproscan/wiki/OutputFormats.
 """
 import json
 import xml.etree.ElementTree as ET
+from array import array
+import numpy as np
+from scipy import sparse
+from src.utils.file_reader import save_sparse_matrix
 
+# namespace of xml file
+NAMESPACE = "{http://www.ebi.ac.uk/interpro/resources/schemas/interproscan5}"
 
-def get_ipr_annotation(path_to_ipr):
-    """Parse the InterPro annotation file.
+
+def get_accession(protein_id):
+    """Extract protein accession from the sequence id in fasta file.
+    :param protein_id: UniProt style id like "sp|P12345|NAME_HUMAN", or plain
+        accession like "P12345"
+    :return: accession, i.e. the 2nd field of UniProt style id, otherwise the
+        whole id
+    """
+    fields = protein_id.split('|')
+    return fields[1] if len(fields) > 1 else protein_id
+
+
+def iter_xml_matches(path_to_ipr):
+    """Parse the xml output file incrementally, each <protein> section is
+    discarded once its matches are extracted.
     :param path_to_ipr: path to the xml output file
-    :return: protein2ipr, dict, containing the InterPro annotations
-        of each protein, like
-        {protein1: {ipr_1: 1, ipr_2: 1, ...}, ...}
+    :return: generator of (protein, set of signature accessions), one for each
+        xref of <protein> section
     """
-    protein2ipr = dict()
-    # namespace of xml file
-    namespace = {"xmlns": "http://www.ebi.ac.uk/interpro/resources/schemas/interproscan5"}
-    # read in xml file
-    tree = ET.parse(path_to_ipr)
-    root = tree.getroot()
-    # parse each section of protein
-    for protein_sec in root.findall("xmlns:protein", namespace):
+    context = ET.iterparse(path_to_ipr, events=("start", "end"))
+    _, root = next(context)
+    for event, protein_sec in context:
+        if event != "end" or protein_sec.tag != NAMESPACE + "protein":
+            continue
         features = set()
         # matches section of this protein
-        matches_sec = protein_sec.find("xmlns:matches", namespace)
+        matches_sec = protein_sec.find(NAMESPACE + "matches")
         for match_sec in matches_sec:
             # each signature matched of this protein
-            signature = match_sec.find("xmlns:signature", namespace)
-            accession = signature.get("ac")
-            features.add(accession)
+            signature = match_sec.find(NAMESPACE + "signature")
+            features.add(signature.get("ac"))
         # get the ID of this protein
-        for xref in protein_sec.findall("xmlns:xref", namespace):
-            xref_id = xref.get("id").split('|')[1]
-            protein2ipr[xref_id] = {ipr: 1 for ipr in features}
-    return protein2ipr
+        for xref in protein_sec.findall(NAMESPACE + "xref"):
+            yield get_accession(xref.get("id")), features
+        # release parsed sections, which are otherwise kept by root
+        protein_sec.clear()
+        root.clear()
+
+
+def iter_tsv_matches(path_to_ipr):
+    """Parse the tsv output file, the 1st column is the protein accession and
+    the 5th column is the signature accession.
+    :param path_to_ipr: path to the tsv output file
+    :return: generator of (protein, set of signature accessions), one for
+        each line
+    """
+    with open(path_to_ipr) as fp:
+        for line in fp:
+            entries = line.rstrip('\n').split('\t')
+            if len(entries) < 5:
+                continue
+            yield get_accession(entries[0]), {entries[4]}
+
+
+def matches_to_csr(matches, replace=False):
+    """Build sparse matrix from streamed matches, only integer indices of the
+    matches are kept in memory, instead of a dict of sets of proteins.
+    :param matches: iterable of (protein, set of signature accessions)
+    :param replace: if True, signatures of a protein are replaced by its last
+        (protein, set) pair, otherwise they are accumulated
+    :return: SciPy CSR matrix (rows: proteins, columns: InterPro signatures,
+        values are 1), list of proteins, list of signatures, both sorted
+    """
+    protein_index, signature_index = dict(), dict()
+    rows, columns, sections = array('q'), array('q'), array('q')
+    # the last section of each protein
+    last_section = array('q')
+    for section, (protein, features) in enumerate(matches):
+        row = protein_index.setdefault(protein, len(protein_index))
+        if row == len(last_section):
+            last_section.append(section)
+        elif replace:
+            last_section[row] = section
+        for feature in features:
+            rows.append(row)
+            columns.append(
+                signature_index.setdefault(feature, len(signature_index)))
+            sections.append(section)
+
+    rows = np.asarray(rows, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.int64)
+    if replace:
+        keep = np.asarray(sections, dtype=np.int64) == \
+            np.asarray(last_section, dtype=np.int64)[rows]
+        rows, columns = rows[keep], columns[keep]
+
+    # sort proteins and signatures (only the ones still matched)
+    proteins = np.asarray(list(protein_index), dtype=object)
+    signatures = np.asarray(list(signature_index), dtype=object)
+    used = np.unique(columns)
+    row_order = np.argsort(proteins, kind="stable")
+    column_order = used[np.argsort(signatures[used], kind="stable")]
+    row_rank = np.empty(len(proteins), dtype=np.int64)
+    row_rank[row_order] = np.arange(len(proteins))
+    column_rank = np.empty(len(signatures), dtype=np.int64)
+    column_rank[column_order] = np.arange(len(column_order))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows)), (row_rank[rows], column_rank[columns])),
+        shape=(len(proteins), len(column_order)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, proteins[row_order].tolist(), \
+        signatures[column_order].tolist()
+
+
+def get_ipr_annotation(path_to_ipr, file_format="xml"):
+    """Parse the InterPro annotation file.
+    :param path_to_ipr: path to the output file of InterProScan
+    :param file_format: format of the output file, "xml" or "tsv"
+    :return: SciPy CSR matrix (rows: proteins, columns: InterPro signatures,
+        values are 1), list of proteins, list of signatures
+    """
+    if file_format == "xml":
+        # the last <protein> section of duplicate xrefs takes effect
+        return matches_to_csr(iter_xml_matches(path_to_ipr), replace=True)
+    elif file_format == "tsv":
+        return matches_to_csr(iter_tsv_matches(path_to_ipr))
+    else:
+        raise ValueError("Unsupported format of InterPro file: %s"
+                         % file_format)
 
 
 if __name__ == "__main__":
     with open("../../../config/feature/InterPro/interpro.json") as fp:
         config = json.load(fp)
 
-    # parse the xml file and obtain the InterPro annotation
-    ipr_annotation = get_ipr_annotation(config["ipr_path"])
+    # parse the output file and obtain the InterPro annotation
+    ipr_annotation, proteins, signatures = get_ipr_annotation(
+        config["ipr_path"], config["format"])
 
     # write into file
-    with open(config["output"], 'w') as fp:
-        json.dump(ipr_annotation, fp, indent=2)
+    save_sparse_matrix(config["output"], ipr_annotation, proteins, signatures)
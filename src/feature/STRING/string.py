@@ -8,7 +8,8 @@ Besides, download mapping file under "ACCESSORY DATA" category, or open website
 https://string-db.org/mapping_files/uniprot_mappings/ to download it.
 """
 import json
-from collections import defaultdict
+from src.utils.file_reader import save_network
+from src.utils.network import load_edge_list, prune_network
 
 
 def string2uniprot(file_path):
@@ -32,32 +33,21 @@ def string2uniprot(file_path):
     return mapping
 
 
-def get_string_network(path_to_network, path_to_mapping):
+def get_string_network(path_to_network, path_to_mapping, n_jobs=1):
     """Construct STRING PPI network.
-    :param path_to_network: path to STRING network data
+    :param path_to_network: path to STRING network data (or its .gz file)
         url: https://string-db.org/cgi/download.pl
     :param path_to_mapping: path to mapping file
         url: https://string-db.org/mapping_files/uniprot_mappings/
-    :return: dict, PPI network
-        { protein1: { protein1a: score1a, protein1b: score1b, ... },
-          protein2: { protein2a: score2a, protein2b: score2b, ... },
-          ... }
+    :param n_jobs: number of processes mapping the network data
+    :return: PPI network, tuple of adjacency matrix (SciPy CSR matrix) and
+        list of proteins
     """
-    network = defaultdict(dict)
     mapping = string2uniprot(path_to_mapping)
-    with open(path_to_network) as fp:
-        for line in fp:
-            if line.startswith("protein1"):
-                continue
-            string_ac1, string_ac2, score = line.strip().split()
-            try:    # if no matched accession found, pass it
-                protein1 = mapping[string_ac1]
-                protein2 = mapping[string_ac2]
-            except KeyError:
-                continue
-            score = float(score) / 1000
-            network[protein1][protein2] = network[protein2][protein1] = score
-    return network
+    # skip the header line, scores are in [0, 1000]
+    return load_edge_list(path_to_network, (0, 1), mapping, score_column=2,
+                          normalizer=1000, sep=r"\s+", header=1,
+                          n_jobs=n_jobs)
 
 
 if __name__ == "__main__":
@@ -65,7 +55,10 @@ if __name__ == "__main__":
         config = json.load(fp)
 
     # get PPI network
-    network = get_string_network(config["network"], config["mapping"])
+    network = get_string_network(config["network"], config["mapping"],
+                                 n_jobs=config["n_jobs"])
+    # drop weak edges
+    adjacency, proteins = network
+    network = prune_network(adjacency, **config["prune"]), proteins
     # write into file
-    with open(config["feature"], 'w') as fp:
-        json.dump(network, fp, indent=2)
+    save_network(config["feature"], network)
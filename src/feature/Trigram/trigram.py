@@ -3,62 +3,113 @@
 """Extract trigram frequency of amino acid sequences.
 
 You can get sequences from https://www.uniprot.org/mapping/.
+The fasta file is read in chunks of whole records, which are counted by a
+pool of processes and merged into one sparse matrix.
 """
 import json
-from collections import defaultdict
-from Bio import SeqIO
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed
+from src.utils.file_reader import save_sparse_matrix, read_fasta_chunks, \
+    parse_fasta
 
 # 20 amino acids (some unknown amino acids are not shown in the following)
 acids = "ACDEFGHIKLMNPQRSTVWY"
-# map amino acids to integers
-acids_idx = {acid: i for i, acid in enumerate(acids)}
+# lookup table from ASCII code to integer, unknown amino acids are mapped to
+# len(acids)
+acids_table = np.full(256, len(acids), dtype=np.uint8)
+acids_table[np.frombuffer(acids.encode("ascii"), dtype=np.uint8)] = \
+    np.arange(len(acids), dtype=np.uint8)
 
 
-def get_id(mers):
-    """Return id of the mers.
-    :param mers: n-gram of amino acid sequence
-    :return: id of the given mers
+def encode_sequences(seqs):
+    """Encode amino acid sequences into one integer array, sequences are
+    separated by an unknown amino acid.
+    :param seqs: list of amino acid sequences (str)
+    :return: numpy array of uint8, numpy array of start of each sequence
     """
-    index = 0
-    for mer in mers:
-        if mer not in acids_idx:
-            return None
-        index = index * len(acids) + acids_idx[mer]
-    return index
+    text = "*".join(seqs) + "*"
+    codes = acids_table[np.frombuffer(text.encode("ascii", "replace"),
+                                      dtype=np.uint8)]
+    lengths = np.array([len(seq) + 1 for seq in seqs], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return codes, starts
 
 
-def get_mer_features(seqs, k):
-    """Return k-gram frequency of amino acid sequence in seqs.
-    :param seqs: list of amino acid sequence
+def count_mers(seqs, k):
+    """Count k-grams of amino acid sequences.
+    :param seqs: list of amino acid sequences (str)
+    :param k: size of gram, 1 <= k <= 5
+    :return: SciPy CSR matrix of float32, rows: sequences, columns: ids of
+        k-grams, i.e. k-grams read as base-20 numbers with digits in the
+        order of acids
+    """
+    assert 1 <= k <= 5, "k must be in 1..5."
+    n_columns = len(acids) ** k
+    # drop the last amino acid, so windows start at 0..len(seq)-k-1 as before
+    codes, starts = encode_sequences([seq[:-1] for seq in seqs])
+    n_windows = len(codes) - k + 1
+    if n_windows <= 0:
+        return sparse.csr_matrix((len(seqs), n_columns), dtype=np.float32)
+    # rolling base-20 ids of k-grams
+    mer_ids = np.zeros(n_windows, dtype=np.int64)
+    unknown = np.zeros(n_windows, dtype=bool)
+    for j in range(k):
+        window = codes[j:j + n_windows]
+        mer_ids = mer_ids * len(acids) + window
+        unknown |= window == len(acids)
+    # windows containing unknown amino acids (or separators) are discarded
+    positions = np.flatnonzero(~unknown)
+    rows = np.searchsorted(starts, positions, side="right") - 1
+    keys, counts = np.unique(rows * n_columns + mer_ids[positions],
+                             return_counts=True)
+    return sparse.csr_matrix(
+        (counts.astype(np.float32), (keys // n_columns, keys % n_columns)),
+        shape=(len(seqs), n_columns))
+
+
+def count_chunk(chunk, k):
+    """Count k-grams of sequences in a chunk of fasta file.
+    :param chunk: bytes of whole fasta records
     :param k: size of gram
-    :return: a dict like
-    { protein1: { k-gram1: frequency1, k-gram2: frequency2, ... }, ... }
+    :return: SciPy CSR matrix of float32, list of UniProt ids
+    """
+    records = parse_fasta(chunk)
+    # extract UniProt id, e.g. sp|P12345|NAME_HUMAN
+    proteins = [record_id.split('|')[1] for record_id, _ in records]
+    matrix = count_mers([seq for _, seq in records], k)
+    return matrix, proteins
+
+
+def get_fasta_features(file_path, k, n_jobs=1, chunk_size=1 << 22):
+    """Return k-gram frequency of sequences in the fasta file.
+    :param file_path: path to fasta file
+    :param k: size of gram, 1 <= k <= 5
+    :param n_jobs: number of processes, -1 means using all processors
+    :param chunk_size: approximate size of chunks in bytes handed to a process
+    :return: SciPy CSR matrix of float32 (rows: proteins, columns: ids of
+        k-grams), list of proteins, list of ids of k-grams
     """
-    features = defaultdict(lambda: defaultdict(int))
-    for seq in seqs:
-        for i in range(len(seq.seq) - k):
-            # slice k-gram
-            mers = seq.seq[i:i+k]
-            # map k-gram to id
-            col_id = get_id(mers)
-            if col_id is not None:
-                features[seq.id][col_id] += 1
-            else:       # unknown amino acid in sequence
-                print(seq.id, mers)
-    return features
+    # chunks are read lazily, at most pre_dispatch chunks are in memory
+    shards = Parallel(n_jobs=n_jobs, pre_dispatch="2*n_jobs")(
+        delayed(count_chunk)(chunk, k)
+        for chunk in read_fasta_chunks(file_path, chunk_size))
+    proteins = [protein for _, shard_proteins in shards
+                for protein in shard_proteins]
+    matrices = [matrix for matrix, _ in shards]
+    if len(matrices) == 0:
+        matrices.append(count_mers([], k))
+    matrix = sparse.vstack(matrices, format="csr")
+    return matrix, proteins, list(range(len(acids) ** k))
 
 
 if __name__ == "__main__":
     with open("../../../config/feature/Trigram/trigram.json") as fp:
         config = json.load(fp)
 
-    # load amino acid sequence
-    seqs = list(SeqIO.parse(config["fasta"], "fasta"))
-    # extract UniPort id
-    for seq in seqs:
-        seq.id = seq.id.split('|')[1]
-    # get features
-    trigrams = get_mer_features(seqs, 3)
+    # count k-grams of chunks of fasta file in parallel
+    trigrams, proteins, mers = get_fasta_features(
+        config["fasta"], config["k"], n_jobs=config["n_jobs"],
+        chunk_size=config["chunk_size"])
     # write into file
-    with open(config["feature"], 'w') as fp:
-        json.dump(trigrams, fp, indent=2)
+    save_sparse_matrix(config["feature"], trigrams, proteins, mers)
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """Split protein list into three parts: train set, ltr set, and test set.
-We will get three annotation datasets, three protein lists, and term list.
+We will get three annotation datasets, three protein lists, term list, and
+vocabularies of proteins and HPO terms.
 Besides, we will split HPO terms into several groups according to frequency.
 """
 import json
+import os
 from collections import defaultdict
 from functools import reduce
 from src.utils.ontology import HumanPhenotypeOntology
 from src.utils.ontology import get_root, get_subontology
+from src.utils.vocabulary import Vocabulary
 
 
 with open("../../config/preprocessing/split_dataset.json") as fp:
@@ -117,3 +120,11 @@ for interval in config["frequency"]:
         json.dump([term for term in term_counts
                    if interval["low"] <= term_counts[term] <= interval["high"]],
                   fp, indent=2)
+
+# write down vocabularies of proteins and HPO terms, which map them to dense
+# integer ids shared by the whole pipeline
+for path in config["vocabulary"].values():
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+Vocabulary(list(train_annotation.keys()) + list(ltr_annotation.keys()) +
+           list(test_annotation.keys())).save(config["vocabulary"]["protein"])
+Vocabulary(sorted(ontology_t0.keys())).save(config["vocabulary"]["term"])
@@ -3,12 +3,17 @@
 """Evaluate performance of prediction methods, including F-max, AUROC and AUPR.
 """
 import json
-from collections import defaultdict
+import time
 import pandas as pd
 import numpy as np
+from scipy import sparse, stats
 from sklearn import metrics
+from joblib import Parallel, delayed, effective_n_jobs
 from src.utils.ontology import HumanPhenotypeOntology, get_ns_id
-from src.utils.file_reader import load_annotation, load_label_list, load_result
+from src.utils.file_reader import load_annotation, load_label_list, \
+    load_result_matrix
+from src.utils.matrix import dict_to_csr
+from src.utils.vocabulary import Vocabulary
 
 # HPO terms' group id according to frequency
 frequency_group = ["very_rare",         # 1-3
@@ -19,86 +24,230 @@ frequency_group = ["very_rare",         # 1-3
                    "extremely_common"]  # >300
 
 
+def _to_csr(matrix):
+    """Convert DataFrame, numpy array or SciPy sparse matrix to CSR matrix.
+    :param matrix: DataFrame, numpy array or SciPy sparse matrix
+    :return: SciPy CSR matrix with the same contents
+    """
+    if isinstance(matrix, pd.DataFrame):
+        matrix = matrix.values
+    return sparse.csr_matrix(matrix)
+
+
+def _to_dense(matrix):
+    """Convert DataFrame, numpy array or SciPy sparse matrix to numpy array.
+    :param matrix: DataFrame, numpy array or SciPy sparse matrix
+    :return: numpy array with the same contents
+    """
+    if isinstance(matrix, pd.DataFrame):
+        return matrix.fillna(0).values
+    if sparse.issparse(matrix):
+        return matrix.toarray()
+    return np.asarray(matrix)
+
+
+def _threshold_counts(rows, scores, n_rows, thresholds):
+    """Count, for each row, the scores retrieved at every threshold.
+    :param rows: row index of each score
+    :param scores: scores to be counted
+    :param n_rows: number of rows
+    :param thresholds: ascending thresholds
+    :return: numpy array of shape (n_rows, n_thresholds), the element (i, j)
+        is the number of scores in row i which are >= thresholds[j]
+    """
+    n_bins = len(thresholds) + 1
+    # the number of thresholds not greater than each score, i.e. the score
+    # is retrieved at thresholds[0], ..., thresholds[bins-1]
+    bins = np.searchsorted(thresholds, scores, side="right")
+    counts = np.bincount(rows * n_bins + bins, minlength=n_rows * n_bins)
+    counts = counts.reshape(n_rows, n_bins)
+    # accumulate from the highest bin down to the lowest one
+    counts = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    return counts[:, 1:]
+
+
+def _protein_counts(result, annotation, thresholds):
+    """Count retrieved, correctly retrieved and relevant HPO terms of each
+    protein at every threshold.
+    :param result: predictive scores, SciPy CSR matrix
+    :param annotation: true HPO annotations aligned with result, SciPy CSR
+        matrix (0: no, 1: yes)
+    :param thresholds: ascending thresholds
+    :return: numpy arrays of retrieved and hits of shape
+        (n_proteins, n_thresholds), and relevant of shape (n_proteins, )
+    """
+    assert result.shape == annotation.shape, \
+        "The shape of result and annotation are must be the same."
+    n_rows, n_cols = result.shape
+
+    # HPO terms retrieved above each threshold
+    n_stored = np.diff(result.indptr)
+    retrieved = _threshold_counts(np.repeat(np.arange(n_rows), n_stored),
+                                  result.data, n_rows, thresholds)
+    # missing scores are zero, retrieved when the threshold is not above zero
+    retrieved += np.outer(n_cols - n_stored, thresholds <= 0)
+
+    # HPO terms associated with the given protein
+    positive = annotation.tocoo()
+    mask = positive.data == 1
+    pos_rows, pos_cols = positive.row[mask], positive.col[mask]
+    relevant = np.bincount(pos_rows, minlength=n_rows)
+    # HPO terms both retrieved and relevant
+    pos_scores = np.asarray(result[pos_rows, pos_cols]).reshape(-1)
+    hits = _threshold_counts(pos_rows, pos_scores, n_rows, thresholds)
+    return retrieved, hits, relevant
+
+
+def f_max_curve(result, annotation, n_threshold=101):
+    """Calculate protein-centric precision and recall at each threshold.
+
+    Scores of each protein are binned by thresholds once, then the number of
+    retrieved and correctly retrieved HPO terms at every threshold are
+    obtained by cumulative sums.
+    :param result: predictive scores, DataFrame, numpy array or SciPy sparse
+        matrix with rows being proteins and columns being HPO terms, which
+        MUST be aligned with annotation
+    :param annotation: true HPO annotations, DataFrame, numpy array or SciPy
+        sparse matrix (0: no, 1: yes)
+    :param n_threshold: number of thresholds, default: 101 (i.e. step=0.01)
+    :return: thresholds, precision and recall, numpy arrays of shape
+        (n_threshold, )
+    """
+    thresholds = np.linspace(0., 1., n_threshold)
+    retrieved, hits, relevant = _protein_counts(
+        _to_csr(result), _to_csr(annotation), thresholds)
+    precision, recall = _precision_recall(retrieved, hits, relevant)
+    return thresholds, precision, recall
+
+
+def _precision_recall(retrieved, hits, relevant):
+    """Calculate protein-centric precision and recall from counts returned by
+    _protein_counts (counts of column blocks of a matrix can be summed up).
+    :param retrieved: numpy array of shape (n_proteins, n_thresholds)
+    :param hits: numpy array of shape (n_proteins, n_thresholds)
+    :param relevant: numpy array of shape (n_proteins, )
+    :return: precision and recall, numpy arrays of shape (n_thresholds, )
+    """
+    n_threshold = retrieved.shape[1]
+    # only proteins having HPO annotations are taken into account
+    annotated = relevant > 0
+    retrieved, hits, relevant = \
+        retrieved[annotated], hits[annotated], relevant[annotated]
+    n_proteins = relevant.shape[0]
+    # proteins annotated at least on predicted HPO term at each threshold
+    covered = retrieved > 0
+    n_proteins_covered = covered.sum(axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(covered, hits / retrieved, 0).sum(axis=0)
+        precision = np.where(n_proteins_covered > 0,
+                             precision / n_proteins_covered, 0)
+        recall = (hits / relevant[:, np.newaxis]).sum(axis=0)
+        recall = recall / n_proteins if n_proteins > 0 else \
+            np.zeros(n_threshold)
+
+    return precision, recall
+
+
 def f_max(result, annotation, n_threshold=101):
     """Calculate F-max and the corresponding threshold
     :param result: predictive scores, DataFrame like
         { protein1: { hpo_term1: score1, ... }, ... }
+        numpy array and SciPy sparse matrix are also accepted
     :param annotation: true HPO annotations, DataFrame like
         { protein1: { hpo_term1: 0/1, ... }, ... } (0: no, 1: yes)
     :param n_threshold: number of thresholds, default: 101 (i.e. step=0.01)
     :return: F-max and the corresponding threshold
     """
-    f_max_list = list()
-
-    # vary the threshold over the range between 0 to 1 with n_threshold steps
-    for threshold in np.linspace(0., 1., n_threshold):
-        n_proteins, n_proteins_covered = 0, 0
-        precision_ths, recall_ths = 0, 0
-
-        # calculate precision and recall of each protein
-        for protein in annotation.axes[0]:
-            # HPO terms retrieved above the given threshold
-            retrieved = set(result.loc[protein][result.loc[protein] >= threshold].index)
-            # HPO terms associated with the given protein
-            relevant = set(annotation.loc[protein][annotation.loc[protein] == 1].index)
-
-            if len(relevant) > 0:
-                # total of proteins having HPO annotations
-                n_proteins += 1
-                if len(retrieved) > 0:
-                    # total of proteins annotated at least on predicted HPO term
-                    n_proteins_covered += 1
-                    precision_ths += len(retrieved & relevant) / len(retrieved)
-                recall_ths += len(retrieved & relevant) / len(relevant)
-
-        try:
-            precision_ths = precision_ths / n_proteins_covered
-        except ZeroDivisionError:
-            precision_ths = 0
-        try:
-            recall_ths /= n_proteins
-        except ZeroDivisionError:
-            recall_ths = 0
-        try:
-            f_max_ths = (2*precision_ths*recall_ths)/(precision_ths+recall_ths)
-        except ZeroDivisionError:
-            f_max_ths = 0
-        f_max_list.append(f_max_ths)
+    _, precision, recall = f_max_curve(result, annotation, n_threshold)
+    return _best_f_max(precision, recall)
+
+
+def _best_f_max(precision, recall):
+    """Search F-max over thresholds.
+    :param precision: numpy array of precision at each threshold
+    :param recall: numpy array of recall at each threshold
+    :return: F-max and the corresponding threshold
+    """
+    n_threshold = len(precision)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f_max_list = np.where(precision + recall > 0,
+                              2 * precision * recall / (precision + recall),
+                              0)
 
     # search the highest F-max value
-    f_max_overall = max(f_max_list)
+    f_max_overall = f_max_list.max()
     # get the corresponding threshold
     threshold = np.argmax(f_max_list) / (n_threshold - 1)
 
     return f_max_overall, threshold
 
 
-def auroc(result, annotation):
+def _column_auroc(result, annotation):
+    """Calculate AUROC of each column of dense matrices by Mann-Whitney U.
+    :param result: predictive scores, numpy array
+    :param annotation: true annotations aligned with result, numpy array
+        (0: no, 1: yes)
+    :return: numpy array of AUROC of each column, nan if only one class
+    """
+    positive = annotation == 1
+    n_pos = positive.sum(axis=0).astype(np.float64)
+    n_neg = positive.shape[0] - n_pos
+    # tie-aware average ranks of all columns at once
+    ranks = stats.rankdata(result, axis=0)
+    u = (ranks * positive).sum(axis=0) - n_pos * (n_pos + 1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((n_pos > 0) & (n_neg > 0), u / (n_pos * n_neg),
+                        np.nan)
+
+
+def term_auroc(result, annotation, chunk_size=None):
+    """Calculate AUROC of each HPO term.
+    :param result: predictive scores, DataFrame, numpy array or SciPy sparse
+        matrix with rows being proteins and columns being HPO terms, which
+        MUST be aligned with annotation
+    :param annotation: true HPO annotations, DataFrame, numpy array or SciPy
+        sparse matrix (0: no, 1: yes)
+    :param chunk_size: number of HPO terms densified at a time, None means
+        all at once
+    :return: numpy array of AUROC of each HPO term, nan if the term has only
+        one class
+    """
+    if isinstance(annotation, pd.DataFrame) and \
+            isinstance(result, pd.DataFrame):
+        result = result.reindex(columns=annotation.columns)
+    if chunk_size is None:
+        return _column_auroc(_to_dense(result), _to_dense(annotation))
+
+    # sparse matrices are sliced by columns, dense ones are sliced in place
+    if isinstance(result, pd.DataFrame) or sparse.issparse(result):
+        result = _to_csr(result).tocsc()
+    if isinstance(annotation, pd.DataFrame) or sparse.issparse(annotation):
+        annotation = _to_csr(annotation).tocsc()
+    n_terms = annotation.shape[1]
+    return np.concatenate(
+        [_column_auroc(_to_dense(result[:, start:start + chunk_size]),
+                       _to_dense(annotation[:, start:start + chunk_size]))
+         for start in range(0, n_terms, chunk_size)] + [np.zeros(0)])
+
+
+def auroc(result, annotation, chunk_size=None):
     """Calculate term-centric AUROC
     :param result: predictive scores, DataFrame like
         { protein1: { hpo_term1: score1, ... }, ... }
+        numpy array and SciPy sparse matrix aligned with annotation are also
+        accepted
     :param annotation: true HPO annotations, DataFrame like
         { protein1: { hpo_term1: 0/1, ... }, ... } (0: no, 1: yes)
-    :return: term-centric AUROC
+        numpy array and SciPy sparse matrix are also accepted
+    :param chunk_size: number of HPO terms densified at a time, None means
+        all at once
+    :return: term-centric AUROC, HPO terms with only one class are skipped
     """
-    auc = 0
-    n_terms = 0
-
-    # scan each HPO term
-    for hpo_term in annotation.axes[1]:
-        y_true = annotation[hpo_term].fillna(0).tolist()
-        y_pred = result[hpo_term].fillna(0).tolist()
-
-        # if only one class
-        if len(np.unique(y_true)) != 2:
-            continue
-
-        n_terms += 1
-        auc += metrics.roc_auc_score(y_true, y_pred)
+    auc = term_auroc(result, annotation, chunk_size)
     # average over terms
-    auc = auc / n_terms if n_terms > 0 else 0
-
-    return auc
+    auc = auc[~np.isnan(auc)]
+    return auc.mean() if len(auc) > 0 else 0
 
 
 def aupr(result, annotation):
@@ -107,14 +256,571 @@ def aupr(result, annotation):
         { protein1: { hpo_term1: score1, ... }, ... }
     :param annotation: true HPO annotations, DataFrame like
         { protein1: { hpo_term1: 0/1, ... }, ... } (0: no, 1: yes)
+        numpy array and SciPy sparse matrix aligned with result are also
+        accepted
     :return: pairwise AUPR
     """
-    y_true = annotation.values.reshape(-1)
-    y_pred = result.values.reshape(-1)
+    y_true = _to_dense(annotation).reshape(-1)
+    y_pred = _to_dense(result).reshape(-1)
     aupr_value = metrics.average_precision_score(y_true, y_pred)
     return aupr_value
 
 
+def _score_counts(result, annotation):
+    """Count positive and all pairs at each distinct score, counts of column
+    blocks of a matrix can be merged by _merge_score_counts.
+    :param result: predictive scores, numpy array
+    :param annotation: true HPO annotations aligned with result, numpy array
+        (0: no, 1: yes)
+    :return: numpy arrays of distinct scores (ascending), the number of
+        positive pairs and the number of all pairs at each score
+    """
+    scores, inverse = np.unique(result, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    positive = np.bincount(inverse, weights=(annotation == 1).reshape(-1),
+                           minlength=len(scores))
+    return scores, positive, np.bincount(inverse, minlength=len(scores))
+
+
+def _merge_score_counts(tables):
+    """Merge counts returned by _score_counts.
+    :param tables: list of (scores, positive, total)
+    :return: merged (scores, positive, total)
+    """
+    scores, inverse = np.unique(np.concatenate(
+        [table[0] for table in tables]), return_inverse=True)
+    positive = np.bincount(inverse, weights=np.concatenate(
+        [table[1] for table in tables]), minlength=len(scores))
+    total = np.bincount(inverse, weights=np.concatenate(
+        [table[2] for table in tables]), minlength=len(scores))
+    return scores, positive, total
+
+
+def _average_precision(positive, total):
+    """Calculate pairwise AUPR (average precision, the same as
+    sklearn.metrics.average_precision_score) from counts of distinct scores.
+    :param positive: number of positive pairs at each distinct score,
+        scores in ascending order
+    :param total: number of all pairs at each distinct score
+    :return: pairwise AUPR
+    """
+    # retrieve pairs from the highest score down to the lowest one
+    true_pos = np.cumsum(positive[::-1])
+    retrieved = np.cumsum(total[::-1])
+    if len(true_pos) == 0 or true_pos[-1] == 0:
+        return 0.
+    recall_step = np.diff(true_pos, prepend=0) / true_pos[-1]
+    return np.sum(recall_step * true_pos / retrieved)
+
+
+class Bootstrap(object):
+    """Bootstrap F-max, term-centric AUROC and pairwise AUPR of one result.
+
+    Statistics of the result are computed once, and each replicate only
+    weights them: proteins drawn k times get weight k in F-max and AUPR, HPO
+    terms drawn k times get weight k in AUROC.
+        - F-max: per-protein precision, coverage and recall at every
+            threshold, so precision and recall of replicates are products
+            of weights and these matrices;
+        - AUPR: protein-HPO term pairs are sorted by score once and counted
+            into (distinct score, protein) positive and negative tables, so
+            a replicate is one weighted cumulative sum over distinct scores,
+            accumulated in chunks of distinct scores to bound the memory;
+        - AUROC: AUROC of each HPO term, averaged with term weights.
+    Attributes:
+        - n_proteins: number of proteins (rows) resampled
+        - n_terms: number of HPO terms having both classes resampled
+        - aupr_chunk_size: number of distinct scores accumulated at a time in
+            AUPR
+        - _precision, _covered, _recall (private): numpy arrays of shape
+            (n_annotated, n_thresholds), statistics of proteins having HPO
+            annotations
+        - _annotated (private): bool numpy array, proteins having HPO
+            annotations
+        - _positive, _negative (private): SciPy CSR matrices of shape
+            (n_scores, n_proteins), number of positive and negative pairs of
+            each protein at each distinct score (descending)
+        - _auc (private): numpy array of AUROC of HPO terms
+    """
+    def __init__(self, result, annotation, n_threshold=101, chunk_size=None,
+                 aupr_chunk_size=1 << 14):
+        """
+        :param result: predictive scores, DataFrame, numpy array or SciPy
+            sparse matrix with rows being proteins and columns being HPO
+            terms, which MUST be aligned with annotation
+        :param annotation: true HPO annotations, DataFrame, numpy array or
+            SciPy sparse matrix (0: no, 1: yes)
+        :param n_threshold: number of thresholds, default: 101
+        :param chunk_size: number of HPO terms ranked at a time in AUROC,
+            None means all at once
+        :param aupr_chunk_size: number of distinct scores accumulated at a
+            time in AUPR, each chunk takes aupr_chunk_size * n_replicates
+            floats per table
+        :return: None
+        """
+        self.aupr_chunk_size = aupr_chunk_size
+        self._auc = term_auroc(result, annotation, chunk_size)
+        self._auc = self._auc[~np.isnan(self._auc)]
+        result, annotation = _to_csr(result), _to_csr(annotation)
+        self.n_proteins, n_cols = result.shape
+        self.n_terms = len(self._auc)
+
+        # F-max
+        retrieved, hits, relevant = _protein_counts(
+            result, annotation, np.linspace(0., 1., n_threshold))
+        self._annotated = relevant > 0
+        retrieved, hits, relevant = retrieved[self._annotated], \
+            hits[self._annotated], relevant[self._annotated]
+        covered = retrieved > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self._precision = np.where(covered, hits / retrieved, 0)
+            self._recall = hits / relevant[:, np.newaxis]
+        self._covered = covered.astype(np.float64)
+
+        # AUPR, missing scores are zero
+        n_stored = np.diff(result.indptr)
+        rows = np.repeat(np.arange(self.n_proteins), n_stored)
+        scores, inverse = np.unique(np.concatenate((result.data, [0.])),
+                                    return_inverse=True)
+        # position of each distinct score in descending order
+        group = len(scores) - 1 - inverse
+        zero_group = group[-1]
+        pairs = sparse.csr_matrix(
+            (np.concatenate((np.ones(len(rows)), n_cols - n_stored)),
+             (np.concatenate((group[:-1],
+                              np.full(self.n_proteins, zero_group))),
+              np.concatenate((rows, np.arange(self.n_proteins))))),
+            shape=(len(scores), self.n_proteins))
+        positive = annotation.tocoo()
+        mask = positive.data == 1
+        pos_rows, pos_cols = positive.row[mask], positive.col[mask]
+        pos_scores = np.asarray(result[pos_rows, pos_cols]).reshape(-1)
+        self._positive = sparse.csr_matrix(
+            (np.ones(len(pos_rows)),
+             (len(scores) - 1 - np.searchsorted(scores, pos_scores),
+              pos_rows)), shape=pairs.shape)
+        self._negative = pairs - self._positive
+
+    def f_max(self, weights):
+        """Weighted F-max.
+        :param weights: numpy array of shape (n_replicates, n_proteins)
+        :return: numpy array of F-max of each replicate
+        """
+        weights = weights[:, self._annotated]
+        n_covered = weights @ self._covered
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(n_covered > 0,
+                                 (weights @ self._precision) / n_covered, 0)
+            recall = (weights @ self._recall) / \
+                weights.sum(axis=1, keepdims=True)
+            f_max_list = np.where(
+                precision + recall > 0,
+                2 * precision * recall / (precision + recall), 0)
+        return np.nan_to_num(f_max_list).max(axis=1)
+
+    def aupr(self, weights):
+        """Weighted pairwise AUPR.
+        :param weights: numpy array of shape (n_replicates, n_proteins)
+        :return: numpy array of AUPR of each replicate
+        """
+        # AUPR is the sum of precision weighted by the increment of true
+        # positives, divided by the number of positives
+        n_positive = np.asarray(self._positive.sum(axis=0)).reshape(-1) @ \
+            weights.T
+        # running totals carried from one chunk of scores to the next
+        true_pos = np.zeros(weights.shape[0])
+        false_pos = np.zeros(weights.shape[0])
+        area = np.zeros(weights.shape[0])
+        for start in range(0, self._positive.shape[0], self.aupr_chunk_size):
+            end = start + self.aupr_chunk_size
+            hits = self._positive[start:end] @ weights.T
+            chunk_true_pos = true_pos + np.cumsum(hits, axis=0)
+            chunk_false_pos = false_pos + np.cumsum(
+                self._negative[start:end] @ weights.T, axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                area += np.where(hits > 0, hits * chunk_true_pos /
+                                 (chunk_true_pos + chunk_false_pos), 0).sum(
+                    axis=0)
+            true_pos, false_pos = chunk_true_pos[-1], chunk_false_pos[-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(n_positive > 0, area / n_positive, 0)
+
+    def auroc(self, weights):
+        """Weighted term-centric AUROC.
+        :param weights: numpy array of shape (n_replicates, n_terms)
+        :return: numpy array of AUROC of each replicate
+        """
+        if self.n_terms == 0:
+            return np.zeros(weights.shape[0])
+        return (weights @ self._auc) / weights.sum(axis=1)
+
+    def replicate_batches(self, weights):
+        """Calculate metrics of several batches of replicates.
+        :param weights: list of (protein_weights, term_weights) of batches
+        :return: list of dict returned by replicate
+        """
+        return [self.replicate(*weight) for weight in weights]
+
+    def replicate(self, protein_weights, term_weights):
+        """Calculate metrics of a batch of replicates.
+        :param protein_weights: numpy array of shape
+            (n_replicates, n_proteins)
+        :param term_weights: numpy array of shape (n_replicates, n_terms)
+        :return: dict, key: metric, value: numpy array of each replicate
+        """
+        return {"f_max": self.f_max(protein_weights),
+                "auroc": self.auroc(term_weights),
+                "aupr": self.aupr(protein_weights)}
+
+    def run(self, n_replicates=1000, batch_size=50, n_jobs=1,
+            random_state=None):
+        """Run bootstrap replicates in batches.
+        :param n_replicates: number of replicates
+        :param batch_size: number of replicates per batch
+        :param n_jobs: number of processes, -1 means using all processors
+        :param random_state: seed of resampling
+        :return: dict, key: metric, value: numpy array of each replicate
+        """
+        rng = np.random.RandomState(random_state)
+        sizes = [min(batch_size, n_replicates - start)
+                 for start in range(0, n_replicates, batch_size)]
+        # weights are drawn here, so results do not depend on n_jobs
+        weights = [(rng.multinomial(self.n_proteins,
+                                    np.full(self.n_proteins,
+                                            1. / self.n_proteins), size)
+                    .astype(np.float64),
+                    rng.multinomial(self.n_terms,
+                                    np.full(self.n_terms, 1. / self.n_terms),
+                                    size).astype(np.float64)
+                    if self.n_terms > 0 else np.zeros((size, 0)))
+                   for size in sizes]
+        if n_jobs == 1:
+            batches = self.replicate_batches(weights)
+        else:
+            # one task per process, so Bootstrap is sent to each process
+            # once instead of once per batch
+            bounds = np.linspace(
+                0, len(weights),
+                min(effective_n_jobs(n_jobs), len(weights)) + 1).astype(int)
+            batches = [batch for batches in Parallel(n_jobs=n_jobs)(
+                delayed(self.replicate_batches)(weights[start:end])
+                for start, end in zip(bounds[:-1], bounds[1:]))
+                for batch in batches]
+        return {metric: np.concatenate([batch[metric] for batch in batches]
+                                       + [np.zeros(0)])
+                for metric in ("f_max", "auroc", "aupr")}
+
+
+def confidence_interval(values, alpha=0.05):
+    """Percentile confidence interval of bootstrap replicates.
+    :param values: numpy array of metric of each replicate
+    :param alpha: significance level, default: 0.05 (i.e. 95% interval)
+    :return: lower and upper bounds
+    """
+    return np.percentile(values, 100 * alpha / 2), \
+        np.percentile(values, 100 * (1 - alpha / 2))
+
+
+def _take_block(matrix, rows, columns):
+    """Densify a block of scores, -1 means a row (column) of zeros.
+    :param matrix: scores loaded by load_result_matrix, numpy array (may be
+        memory-mapped or a broadcast view) or SciPy CSR matrix
+    :param rows: numpy array of row indices
+    :param columns: numpy array of column indices
+    :return: float64 numpy array of shape (len(rows), len(columns))
+    """
+    block = np.zeros((len(rows), len(columns)))
+    found_rows, found_columns = rows >= 0, columns >= 0
+    if sparse.issparse(matrix):
+        selected = matrix[rows[found_rows]][:, columns[found_columns]]
+        selected = selected.toarray()
+    else:
+        selected = matrix[np.ix_(rows[found_rows], columns[found_columns])]
+    block[np.ix_(found_rows, found_columns)] = selected
+    return block
+
+
+class Evaluator(object):
+    """Evaluate prediction results against test annotations.
+
+    Proteins and HPO terms of test annotations are mapped to a shared integer
+    index once, ordered by the vocabularies of the pipeline if given (see
+    split_dataset). Labels of each namespace are kept as float32 arrays, and
+    each result is loaded as one float64 score matrix over the index, then
+    all metrics are calculated on row and column slices of it.
+    Attributes:
+        - proteins: Vocabulary of proteins in test annotations
+        - terms: Vocabulary of HPO terms in test annotations
+        - _rows, _columns (private): dict, key: namespace (or "all"), value:
+            ids of proteins and HPO terms of the namespace in the index
+        - _labels (private): dict, key: namespace (or "all"), value: labels
+            of the namespace, float32 array of shape (n_rows, n_columns)
+        - _groups (private): dict, key: group id, value: positions of HPO
+            terms of the frequency group in columns of "all"
+        - chunk_size: number of HPO terms of the result densified at a time,
+            None means loading the whole result as a dense matrix
+    """
+    def __init__(self, annotations, frequency=None, chunk_size=None,
+                 proteins=None, terms=None):
+        """
+        :param annotations: dict, key: namespace (or "all"), value:
+            propagated HPO annotations of the namespace, like
+            { protein1: [ hpo_term1, hpo_term2, ... ] ... }
+        :param frequency: dict, key: frequency group id, value: list of HPO
+            terms in the group, evaluated on annotations of "all"
+        :param chunk_size: number of HPO terms of the result densified at a
+            time, None means loading the whole result as a dense matrix
+        :param proteins: Vocabulary of proteins of the pipeline, None means
+            proteins are indexed in the order of annotations
+        :param terms: Vocabulary of HPO terms of the pipeline, None means
+            HPO terms are indexed in the order of annotations
+        :return: None
+        """
+        self.chunk_size = chunk_size
+        matrices = dict()
+        for ns, annotation in annotations.items():
+            matrices[ns] = dict_to_csr(annotation, rows=list(
+                annotation), columns=list(dict.fromkeys(
+                    term for terms in annotation.values() for term in terms)),
+                dtype=np.float32)
+        self.proteins = self._index(
+            [rows for _, rows, _ in matrices.values()], proteins, "proteins")
+        self.terms = self._index(
+            [columns for _, _, columns in matrices.values()], terms,
+            "HPO terms")
+
+        self._rows, self._columns, self._labels = dict(), dict(), dict()
+        for ns, (matrix, rows, columns) in matrices.items():
+            self._rows[ns] = self.proteins.encode(rows)
+            self._columns[ns] = self.terms.encode(columns)
+            self._labels[ns] = matrix.toarray()
+
+        self._groups = dict()
+        for group_id, terms in (frequency or dict()).items():
+            # HPO terms not annotated have no positive, so they are skipped
+            positions = Vocabulary(self.terms.decode(
+                self._columns["all"])).encode(terms)
+            self._groups[group_id] = positions[positions >= 0]
+
+    @staticmethod
+    def _index(token_lists, vocabulary=None, name="identifiers"):
+        """Index identifiers in annotations.
+        :param token_lists: list of lists of identifiers
+        :param vocabulary: Vocabulary of the pipeline, None means indexing
+            identifiers in the order of appearance
+        :param name: name of identifiers, used in the error message
+        :return: Vocabulary of identifiers
+        """
+        index = Vocabulary()
+        for tokens in token_lists:
+            index.extend(tokens)
+        if vocabulary is None:
+            return index
+        ids = vocabulary.encode(index.tokens)
+        if np.any(ids < 0):
+            raise ValueError("%d %s of annotations are not in vocabulary." %
+                             (np.sum(ids < 0), name))
+        # keep the order of ids of the pipeline
+        return Vocabulary(vocabulary.decode(np.sort(ids)))
+
+    def load_scores(self, file_path):
+        """Load prediction results over the index.
+        :param file_path: path to result store (or json file) of predictions
+        :return: float64 array of shape (n_proteins, n_terms), missing scores
+            are 0
+        """
+        scores, _, _ = load_result_matrix(file_path,
+                                          proteins=self.proteins.tokens,
+                                          terms=self.terms.tokens)
+        return np.ascontiguousarray(_to_dense(scores), dtype=np.float64)
+
+    def _evaluate_chunks(self, file_path):
+        """Calculate the same metrics as evaluate, but only chunk_size
+        columns of the (memory-mapped) result store are densified at a time.
+        F-max counts, AUPR counts of distinct scores and AUROC of terms are
+        accumulated over column chunks.
+        :param file_path: path to result store (or json file) of predictions
+        :return: dict, see evaluate
+        """
+        matrix, rows, columns = load_result_matrix(file_path)
+        row_ids = Vocabulary(rows).encode(self.proteins.tokens)
+        column_ids = Vocabulary(columns).encode(self.terms.tokens)
+        thresholds = np.linspace(0., 1., 101)
+
+        performance = dict()
+        for ns in self._labels:
+            if ns == "all":
+                continue
+            ns_rows, ns_columns = row_ids[self._rows[ns]], \
+                column_ids[self._columns[ns]]
+            counts, tables, auc = None, list(), list()
+            for start in range(0, len(ns_columns), self.chunk_size):
+                block = _take_block(matrix, ns_rows,
+                                    ns_columns[start:start + self.chunk_size])
+                annotation = self._labels[ns][
+                    :, start:start + self.chunk_size]
+                block_counts = _protein_counts(
+                    sparse.csr_matrix(block), sparse.csr_matrix(annotation),
+                    thresholds)
+                counts = block_counts if counts is None else \
+                    [a + b for a, b in zip(counts, block_counts)]
+                tables.append(_score_counts(block, annotation))
+                auc.append(_column_auroc(block, annotation))
+
+            performance[ns] = dict()
+            if counts is None:
+                counts = (np.zeros((len(ns_rows), len(thresholds))),
+                          np.zeros((len(ns_rows), len(thresholds))),
+                          np.zeros(len(ns_rows)))
+                tables = [(np.zeros(0), np.zeros(0), np.zeros(0))]
+            f_max_ns, threshold_ns = _best_f_max(*_precision_recall(*counts))
+            performance[ns]['f_max'] = f_max_ns
+            performance[ns]['threshold'] = threshold_ns
+            auc = np.concatenate(auc + [np.zeros(0)])
+            auc = auc[~np.isnan(auc)]
+            performance[ns]['auroc'] = auc.mean() if len(auc) > 0 else 0
+            performance[ns]['aupr'] = _average_precision(
+                *_merge_score_counts(tables)[1:])
+
+        # calculate AUROC by groups, on HPO terms of each group
+        performance["frequency"] = dict()
+        all_rows = row_ids[self._rows["all"]]
+        for group_id, positions in self._groups.items():
+            group_columns = column_ids[self._columns["all"][positions]]
+            auc = np.concatenate([_column_auroc(
+                _take_block(matrix, all_rows,
+                            group_columns[start:start + self.chunk_size]),
+                self._labels["all"][:, positions[start:start +
+                                                 self.chunk_size]])
+                for start in range(0, len(positions), self.chunk_size)] +
+                [np.zeros(0)])
+            auc = auc[~np.isnan(auc)]
+            performance["frequency"][group_id] = \
+                auc.mean() if len(auc) > 0 else 0
+        return performance
+
+    def evaluate(self, file_path):
+        """Calculate F-max, term-centric AUROC and pairwise AUPR of each
+        namespace, and term-centric AUROC of each frequency group.
+        :param file_path: path to result store (or json file) of predictions
+        :return: dict, like
+            { ns1: { "f_max": ..., "threshold": ..., "auroc": ...,
+                     "aupr": ... }, ...,
+              "frequency": { group_id1: auroc1, ... } }
+        """
+        if self.chunk_size is not None:
+            return self._evaluate_chunks(file_path)
+        scores = self.load_scores(file_path)
+        performance = dict()
+        for ns in self._labels:
+            if ns == "all":
+                continue
+            performance[ns] = dict()
+            # get result only in one sub-ontology
+            result = scores[np.ix_(self._rows[ns], self._columns[ns])]
+            annotation = self._labels[ns]
+
+            # calculate F-max
+            f_max_ns, threshold_ns = f_max(result, annotation)
+            performance[ns]['f_max'] = f_max_ns
+            performance[ns]['threshold'] = threshold_ns
+            # calculate term-centric AUROC
+            performance[ns]['auroc'] = auroc(result, annotation)
+            # calculate pairwise AUPR
+            performance[ns]['aupr'] = aupr(result, annotation)
+
+        # calculate AUROC by groups, on HPO terms of each group
+        performance["frequency"] = dict()
+        for group_id, positions in self._groups.items():
+            performance["frequency"][group_id] = auroc(
+                scores[np.ix_(self._rows["all"],
+                              self._columns["all"][positions])],
+                self._labels["all"][:, positions])
+        return performance
+
+    def bootstrap(self, file_path, n_replicates=1000, alpha=0.05,
+                  batch_size=50, n_jobs=1, random_state=None):
+        """Calculate bootstrap confidence intervals of F-max, term-centric
+        AUROC and pairwise AUPR of each namespace.
+        :param file_path: path to result store (or json file) of predictions
+        :param n_replicates: number of replicates
+        :param alpha: significance level, default: 0.05 (i.e. 95% interval)
+        :param batch_size: number of replicates per batch
+        :param n_jobs: number of processes, -1 means using all processors
+        :param random_state: seed of resampling
+        :return: dict, like
+            { ns1: { "f_max": (low, high), "auroc": (low, high),
+                     "aupr": (low, high) }, ... }
+        """
+        scores = self.load_scores(file_path)
+        intervals = dict()
+        for ns in self._labels:
+            if ns == "all":
+                continue
+            replicates = Bootstrap(
+                scores[np.ix_(self._rows[ns], self._columns[ns])],
+                self._labels[ns], chunk_size=self.chunk_size).run(
+                n_replicates, batch_size, n_jobs, random_state)
+            intervals[ns] = {metric: confidence_interval(values, alpha)
+                             for metric, values in replicates.items()}
+        return intervals
+
+
+def _timed_evaluate(evaluator, file_path):
+    """Evaluate one result and measure the runtime.
+    :param evaluator: Evaluator
+    :param file_path: path to result store (or json file) of predictions
+    :return: performance returned by Evaluator.evaluate, runtime in seconds
+    """
+    start = time.perf_counter()
+    performance = evaluator.evaluate(file_path)
+    return performance, time.perf_counter() - start
+
+
+def evaluate_results(evaluator, file_paths, n_jobs=1):
+    """Evaluate results in parallel. Label arrays of evaluator are memory
+    mapped by joblib, so they are shared by worker processes instead of
+    being copied into each of them.
+    :param evaluator: Evaluator
+    :param file_paths: list of paths to result stores (or json files)
+    :param n_jobs: number of processes, -1 means using all processors
+    :return: dict, key: path to result, value: performance returned by
+        Evaluator.evaluate; dict, key: path to result, value: runtime in
+        seconds
+    """
+    if n_jobs == 1:
+        outputs = [_timed_evaluate(evaluator, file_path)
+                   for file_path in file_paths]
+    else:
+        outputs = Parallel(n_jobs=n_jobs)(
+            delayed(_timed_evaluate)(evaluator, file_path)
+            for file_path in file_paths)
+    performance = {file_path: output[0]
+                   for file_path, output in zip(file_paths, outputs)}
+    runtime = {file_path: output[1]
+               for file_path, output in zip(file_paths, outputs)}
+    return performance, runtime
+
+
+def performance_table(performance, runtime=None):
+    """Flatten performance of results into a table.
+    :param performance: dict returned by evaluate_results
+    :param runtime: dict, key: path to result, value: runtime in seconds
+    :return: DataFrame, one row per result, columns like "<ns>_f_max" and
+        "frequency_<group_id>", and "time" if runtime is given
+    """
+    table = dict()
+    for res, perf_res in performance.items():
+        row = dict()
+        for ns, perf_ns in perf_res.items():
+            for metric, value in perf_ns.items():
+                row["%s_%s" % (ns, metric)] = float(value)
+        if runtime is not None:
+            row["time"] = runtime[res]
+        table[res] = row
+    return pd.DataFrame.from_dict(table, orient="index")
+
+
 if __name__ == "__main__":
     with open("../../config/utils/evaluation/evaluation.json") as fp:
         config = json.load(fp)
@@ -126,71 +832,50 @@ if __name__ == "__main__":
     ns_id = get_ns_id(version=config["ontology"]["version"])
 
     # HPO annotations separated into sub-ontology
-    # key: namespace of sub-ontology
-    # value: DataFrame, row: protein, column: HPO term, value: 0/1
-    df_annotation = dict()
+    annotations = dict()
     for ns in ns_id + ["all"]:
+        if ns == "freq":
+            continue
         # load propagated HPO annotations of specified sub-ontology
-        annotation_ns = load_annotation(config["annotation"], ontology, ns=ns)
-        # transform it to double-layer dict, i.e.
-        # { protein1: { hpo_term1: score1, hpo_term2: score2, ... }, ... }
-        dict_annotation_ns = defaultdict(dict)
-        for protein in annotation_ns:
-            for hpo_term in annotation_ns[protein]:
-                dict_annotation_ns[protein][hpo_term] = 1
-        # convert annotation to DataFrame
-        df_annotation_ns = pd.DataFrame.from_dict(dict_annotation_ns,
-                                                  orient="index")
-        df_annotation[ns] = df_annotation_ns.fillna(0)
+        annotations[ns] = load_annotation(config["annotation"], ontology,
+                                          ns=ns)
 
     # load HPO terms list according to frequency
     frequency = dict()
     for group_id in frequency_group:
         frequency[group_id] = load_label_list(config["frequency"][group_id])
 
-    performance = dict()
-    # evaluate each result in the list
-    for res in config["result"]:
-        performance[res] = dict()
-        # load prediction result
-        result = load_result(res)
-        df_result = pd.DataFrame.from_dict(result, orient="index")
-        # separate into sub-ontology
-        for ns in ns_id:
-            if ns == "freq":
-                continue
-
-            performance[res][ns] = dict()
-            # get result only in one sub-ontology
-            df_result_ns = df_result.reindex_like(df_annotation[ns])
-            df_result_ns = df_result_ns.fillna(0)
-
-            # calculate F-max
-            f_max_ns, threshold_ns = f_max(df_result_ns, df_annotation[ns])
-            performance[res][ns]['f_max'] = f_max_ns
-            performance[res][ns]['threshold'] = threshold_ns
-
-            # calculate term-centric AUROC
-            term_auroc_ns = auroc(df_result_ns, df_annotation[ns])
-            performance[res][ns]['auroc'] = term_auroc_ns
+    # map annotations to integer index once
+    # vocabularies of the pipeline written by split_dataset
+    vocabulary = {key: Vocabulary.load(path) for key, path
+                  in config.get("vocabulary", dict()).items()}
+    evaluator = Evaluator(annotations, frequency,
+                          chunk_size=config.get("chunk_size"),
+                          proteins=vocabulary.get("protein"),
+                          terms=vocabulary.get("term"))
 
-            # calculate pairwise AUPR
-            pair_aupr_ns = aupr(df_result_ns, df_annotation[ns])
-            performance[res][ns]['aupr'] = pair_aupr_ns
+    # evaluate each result in the list
+    performance, runtime = evaluate_results(evaluator, config["result"],
+                                            n_jobs=config.get("n_jobs", 1))
 
-        # calculate AUROC by groups
-        performance[res]["frequency"] = dict()
-        for group_id in frequency_group:
-            # select annotations of sub-group of HPO terms
-            df_annotation_freq = df_annotation["all"].reindex(
-                columns=frequency[group_id], fill_value=0)
-            # select prediction result of sub-group of HPO terms
-            df_result_freq = df_result.reindex_like(df_annotation_freq)
-            df_result_freq = df_result_freq.fillna(0)
+    # bootstrap confidence intervals, added as "<metric>_low/high"
+    if config.get("bootstrap"):
+        for res in config["result"]:
+            # n_jobs of the bootstrap block overrides the global one
+            intervals = evaluator.bootstrap(res, **dict(
+                {"n_jobs": config.get("n_jobs", 1)}, **config["bootstrap"]))
+            for ns, interval_ns in intervals.items():
+                for metric, (low, high) in interval_ns.items():
+                    performance[res][ns][metric + "_low"] = low
+                    performance[res][ns][metric + "_high"] = high
 
-            # calculate term-centric AUROC according to frequency
-            term_auroc_freq = auroc(df_result_freq, df_annotation_freq)
-            performance[res]["frequency"][group_id] = term_auroc_freq
+    # write performance table with runtime of each result
+    if config.get("performance"):
+        table = performance_table(performance, runtime)
+        if config["performance"].endswith(".csv"):
+            table.to_csv(config["performance"])
+        else:
+            table.to_json(config["performance"], orient="index", indent=2)
 
     # pretty output
     for res in performance:
@@ -205,3 +890,11 @@ if __name__ == "__main__":
         for group_id in frequency_group:
             print(round(performance[res]['frequency'][group_id], 4), end='\t')
         print()
+        if config.get("bootstrap"):
+            for ns in ns_id:
+                if ns == "freq":
+                    continue
+                print(ns, *["[%.4f, %.4f]" % (
+                    performance[res][ns][metric + "_low"],
+                    performance[res][ns][metric + "_high"])
+                    for metric in ("f_max", "auroc", "aupr")], sep='\t')
@@ -3,8 +3,13 @@
 """Readers of files with different formats.
 """
 import json
+import os
 from collections import defaultdict
+import numpy as np
+from scipy import sparse
 from src.utils.ontology import get_root, get_subontology
+from src.utils.matrix import dict_to_csr, csr_to_dict
+from src.utils.vocabulary import Vocabulary
 
 
 def gene2uniprot(file_path, gene_column, uniprot_column):
@@ -78,23 +83,316 @@ def load_protein(file_path):
     return protein_list
 
 
-def load_feature(file_path):
+def save_sparse_matrix(dir_path, matrix, rows, columns, dtype=np.float32):
+    """Save sparse matrix in a directory of .npy files, i.e. CSR arrays
+    (indptr.npy, indices.npy, data.npy), row ids (rows.npy) and column ids
+    (columns.npy), which can be memory-mapped when loading.
+    :param dir_path: path to the output directory
+    :param matrix: SciPy sparse matrix
+    :param rows: list of row ids
+    :param columns: list of column ids
+    :param dtype: data type of data.npy, default: float32
+    :return: None
+    """
+    # copy, so sorting indices below doesn't reorder indices of the caller
+    matrix = sparse.csr_matrix(matrix, dtype=dtype, copy=True)
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    assert matrix.shape == (len(rows), len(columns)), \
+        "The shape of matrix must match the number of rows and columns."
+    # use int32 indices whenever possible, so SciPy needn't cast them
+    index_dtype = np.int32 if matrix.nnz < 2 ** 31 else np.int64
+    os.makedirs(dir_path, exist_ok=True)
+    np.save(os.path.join(dir_path, "indptr.npy"),
+            matrix.indptr.astype(index_dtype))
+    np.save(os.path.join(dir_path, "indices.npy"),
+            matrix.indices.astype(index_dtype))
+    np.save(os.path.join(dir_path, "data.npy"), matrix.data)
+    np.save(os.path.join(dir_path, "rows.npy"), np.asarray(rows, dtype=str))
+    np.save(os.path.join(dir_path, "columns.npy"),
+            np.asarray(columns, dtype=str))
+
+
+def load_sparse_matrix(dir_path, mmap_mode="r"):
+    """Load sparse matrix saved by save_sparse_matrix.
+    :param dir_path: path to the directory
+    :param mmap_mode: memory-map mode of numpy.load, None means reading the
+        arrays into memory
+    :return: SciPy CSR matrix, numpy array of row ids, numpy array of column
+        ids
+    """
+    def _load(name):
+        return np.load(os.path.join(dir_path, name), mmap_mode=mmap_mode)
+
+    rows, columns = _load("rows.npy"), _load("columns.npy")
+    matrix = sparse.csr_matrix(
+        (_load("data.npy"), _load("indices.npy"), _load("indptr.npy")),
+        shape=(len(rows), len(columns)), copy=False)
+    # saved in canonical format, keep SciPy from sorting read-only arrays
+    matrix.has_canonical_format = True
+    return matrix, np.asarray(rows), np.asarray(columns)
+
+
+def save_network(dir_path, network):
+    """Save PPI network in the format of save_sparse_matrix.
+    :param dir_path: path to the output directory
+    :param network: PPI network, dict like
+        { protein1: { protein1a: score1a, protein1b: score1b, ... }, ... }
+        or tuple of adjacency matrix and list of proteins
+    :return: None
+    """
+    if isinstance(network, dict):
+        proteins = sorted(set(network) |
+                          set(neighbour for protein in network
+                              for neighbour in network[protein]))
+        adjacency, _, _ = dict_to_csr(network, rows=proteins,
+                                      columns=proteins)
+    else:
+        adjacency, proteins = network
+    save_sparse_matrix(dir_path, adjacency, proteins, proteins)
+
+
+def load_network(dir_path, mmap_mode="r"):
+    """Load PPI network saved by save_network.
+    :param dir_path: path to the network directory
+    :param mmap_mode: memory-map mode of numpy.load
+    :return: adjacency matrix (SciPy CSR matrix of float32), numpy array of
+        proteins (rows and columns of the matrix)
+    """
+    adjacency, proteins, _ = load_sparse_matrix(dir_path, mmap_mode)
+    return adjacency, proteins
+
+
+def load_feature(file_path, as_csr=False):
     """Load features into a dict.
-    :param file_path: path to feature file
+    :param file_path: path to feature file, or directory of features saved by
+        save_sparse_matrix (e.g. network saved by save_network)
+    :param as_csr: if True, return features as sparse matrix instead, which is
+        memory-mapped from file_path (network) or from the cache directory
+        "<file_path>.csr" built from the feature file at the first time
     :return: dict,
     { protein1: { feature1: score1, feature2: score2, ... } ... }
+        or if as_csr is True, SciPy CSR matrix (rows: proteins, columns:
+        features), numpy array of proteins, numpy array of features
     """
+    if os.path.isdir(file_path):
+        matrix, rows, columns = load_sparse_matrix(file_path)
+        if as_csr:
+            return matrix, rows, columns
+        return csr_to_dict(matrix, rows.tolist(), columns.tolist())
+
+    if as_csr:
+        cache_path = file_path + ".csr"
+        # columns.npy is saved at last, rebuild cache if it is missing or
+        # older than the feature file
+        saved_path = os.path.join(cache_path, "columns.npy")
+        if not os.path.exists(saved_path) or \
+                os.path.getmtime(saved_path) < os.path.getmtime(file_path):
+            matrix, rows, columns = dict_to_csr(load_feature(file_path))
+            save_sparse_matrix(cache_path, matrix, rows, columns)
+        return load_sparse_matrix(cache_path)
+
     with open(file_path) as fp:
         feature = json.load(fp)
     return feature
 
 
+def read_fasta_chunks(file_path, chunk_size=1 << 22):
+    """Read fasta file in chunks of bytes, each chunk consists of whole
+    records, so they can be parsed independently by parse_fasta.
+    :param file_path: path to fasta file
+    :param chunk_size: approximate size of chunks in bytes
+    :return: generator of bytes
+    """
+    with open(file_path, "rb") as fp:
+        rest = b""
+        for block in iter(lambda: fp.read(chunk_size), b""):
+            rest += block
+            # split at the start of the last record in the buffer
+            end = rest.rfind(b"\n>")
+            if end >= 0:
+                yield rest[:end + 1]
+                rest = rest[end + 1:]
+        if len(rest.strip()) > 0:
+            yield rest
+
+
+def parse_fasta(chunk):
+    """Parse records of fasta file.
+    :param chunk: bytes of whole records, e.g. chunk of read_fasta_chunks
+    :return: list of (id, sequence), id is the first word of the header
+    [ (id1, sequence1), (id2, sequence2), ... ]
+    """
+    records = list()
+    for record in chunk.decode("ascii", "replace").split("\n>"):
+        header, _, sequence = record.lstrip(">").partition("\n")
+        header = header.split()
+        if len(header) == 0:
+            continue
+        sequence = "".join(sequence.split())
+        records.append((header[0], sequence))
+    return records
+
+
+def save_result(dir_path, result, proteins=None, terms=None, dense=None):
+    """Save prediction results in result store, i.e. a directory containing
+    meta.json (format of the store), proteins (rows.npy), HPO terms
+    (columns.npy) and scores in float64, either dense matrix (scores.npy) or
+    CSR arrays (see save_sparse_matrix), which can be memory-mapped when
+    loading. Scores are compared with thresholds in evaluation, so they are
+    not rounded to float32 (e.g. 0.3 in float32 is above 0.3 in float64).
+    :param dir_path: path to the output directory
+    :param result: dict like
+        { protein1: { hpo_term1: score1, hpo_term2: score2, ... } ... }
+        or numpy array or SciPy sparse matrix of shape (n_proteins, n_terms)
+    :param proteins: list of proteins, rows of result matrix
+    :param terms: list of HPO terms, columns of result matrix
+    :param dense: whether to save dense matrix, None means choosing the
+        smaller one, i.e. dense if more than half of scores are non-zero
+    :return: None
+    """
+    if isinstance(result, dict):
+        result, proteins, terms = dict_to_csr(result, rows=proteins,
+                                              columns=terms)
+    assert result.shape == (len(proteins), len(terms)), \
+        "The shape of result must match the number of proteins and terms."
+    if dense is None:
+        n_scores = result.nnz if sparse.issparse(result) \
+            else np.count_nonzero(result)
+        dense = n_scores * 2 > result.shape[0] * result.shape[1]
+    if dense:
+        os.makedirs(dir_path, exist_ok=True)
+        if sparse.issparse(result):
+            result = result.toarray()
+        np.save(os.path.join(dir_path, "scores.npy"),
+                np.asarray(result, dtype=np.float64))
+        np.save(os.path.join(dir_path, "rows.npy"),
+                np.asarray(proteins, dtype=str))
+        np.save(os.path.join(dir_path, "columns.npy"),
+                np.asarray(terms, dtype=str))
+    else:
+        save_sparse_matrix(dir_path, sparse.csr_matrix(result), proteins,
+                           terms, dtype=np.float64)
+    with open(os.path.join(dir_path, "meta.json"), 'w') as fp:
+        json.dump({"format": "dense" if dense else "sparse"}, fp)
+
+
+def save_prior_result(dir_path, prior, proteins):
+    """Save prediction results shared by all proteins (e.g. Naive model) in
+    result store, only one vector of scores (scores.npy) is saved, which is
+    broadcast to proteins lazily when loading.
+    :param dir_path: path to the output directory
+    :param prior: dict, scores of HPO terms, like
+        { hpo_term1: score1, hpo_term2: score2, ... }
+    :param proteins: list of proteins sharing the scores
+    :return: None
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    terms = list(prior)
+    np.save(os.path.join(dir_path, "scores.npy"),
+            np.array([prior[term] for term in terms], dtype=np.float64))
+    np.save(os.path.join(dir_path, "rows.npy"),
+            np.asarray(proteins, dtype=str))
+    np.save(os.path.join(dir_path, "columns.npy"),
+            np.asarray(terms, dtype=str))
+    with open(os.path.join(dir_path, "meta.json"), 'w') as fp:
+        json.dump({"format": "prior"}, fp)
+
+
+def _broadcast(prior, rows, columns):
+    """Broadcast selected columns of prior to selected rows, -1 means a row
+    (column) of zeros.
+    :param prior: numpy array of scores shared by rows
+    :param rows: numpy array of row indices
+    :param columns: numpy array of column indices
+    :return: numpy array of the dtype of prior, a read-only view if no row is
+        missing
+    """
+    scores = np.zeros(len(columns), dtype=prior.dtype)
+    scores[columns >= 0] = prior[columns[columns >= 0]]
+    if np.all(rows >= 0):
+        return np.broadcast_to(scores, (len(rows), len(columns)))
+    return np.outer(rows >= 0, scores).astype(prior.dtype)
+
+
+def _select(matrix, rows, columns):
+    """Select rows and columns of matrix, -1 means a row (column) of zeros.
+    :param matrix: numpy array (may be memory-mapped) or SciPy CSR matrix
+    :param rows: numpy array of row indices
+    :param columns: numpy array of column indices
+    :return: numpy array or SciPy CSR matrix of the dtype of matrix
+    """
+    found_rows, found_columns = rows >= 0, columns >= 0
+    if not sparse.issparse(matrix):
+        selected = np.zeros((len(rows), len(columns)), dtype=matrix.dtype)
+        selected[np.ix_(found_rows, found_columns)] = \
+            matrix[np.ix_(rows[found_rows], columns[found_columns])]
+        return selected
+    # place selected rows and columns by 0/1 matrices
+    row_selection = sparse.csr_matrix(
+        (np.ones(found_rows.sum(), dtype=matrix.dtype),
+         (np.flatnonzero(found_rows), rows[found_rows])),
+        shape=(len(rows), matrix.shape[0]))
+    column_selection = sparse.csr_matrix(
+        (np.ones(found_columns.sum(), dtype=matrix.dtype),
+         (columns[found_columns], np.flatnonzero(found_columns))),
+        shape=(matrix.shape[1], len(columns)))
+    return sparse.csr_matrix(row_selection @ matrix @ column_selection)
+
+
+def load_result_matrix(file_path, proteins=None, terms=None, mmap_mode="r"):
+    """Load prediction results as matrix, only the given proteins and HPO
+    terms are read from the (memory-mapped) result store.
+    :param file_path: path to result store saved by save_result, or json file
+        of prediction results
+    :param proteins: list of proteins to load, scores of proteins not in the
+        result are zeros, None means all proteins in the result
+    :param terms: list of HPO terms to load, scores of terms not in the
+        result are zeros, None means all terms in the result
+    :param mmap_mode: memory-map mode of numpy.load
+    :return: scores (numpy array for dense and prior store, the latter is a
+        read-only broadcast view if possible, otherwise SciPy CSR matrix, in
+        float64 unless the store is older), numpy array of proteins, numpy
+        array of HPO terms
+    """
+    if not os.path.isdir(file_path):
+        matrix, rows, columns = dict_to_csr(load_result(file_path))
+        matrix_format = "sparse"
+    else:
+        with open(os.path.join(file_path, "meta.json")) as fp:
+            matrix_format = json.load(fp)["format"]
+        if matrix_format in ("dense", "prior"):
+            rows = np.load(os.path.join(file_path, "rows.npy"))
+            columns = np.load(os.path.join(file_path, "columns.npy"))
+            matrix = np.load(os.path.join(file_path, "scores.npy"),
+                             mmap_mode=mmap_mode)
+        else:
+            matrix, rows, columns = load_sparse_matrix(file_path, mmap_mode)
+
+    rows, columns = np.asarray(rows, dtype=str), np.asarray(columns, dtype=str)
+    if proteins is None and terms is None and matrix_format != "prior":
+        return matrix, rows, columns
+    row_ids = np.arange(len(rows)) if proteins is None \
+        else Vocabulary(rows).encode(proteins)
+    column_ids = np.arange(len(columns)) if terms is None \
+        else Vocabulary(columns).encode(terms)
+    proteins = rows if proteins is None else np.asarray(proteins, dtype=str)
+    terms = columns if terms is None else np.asarray(terms, dtype=str)
+    if matrix_format == "prior":
+        return _broadcast(matrix, row_ids, column_ids), proteins, terms
+    return _select(matrix, row_ids, column_ids), proteins, terms
+
+
 def load_result(file_path):
     """Load prediction results.
-    :param file_path: path to prediction result file
+    :param file_path: path to prediction result file, or result store saved
+        by save_result
     :return: dict, like
     { protein1: { hpo_term1: score1, hpo_term2: score2, ... } ... }
     """
+    if os.path.isdir(file_path):
+        matrix, proteins, terms = load_result_matrix(file_path)
+        return csr_to_dict(matrix, proteins.tolist(), terms.tolist())
     with open(file_path) as fp:
         result = json.load(fp)
     return result
@@ -3,7 +3,12 @@
 """Definition of Gene Ontology.
 """
 from collections import defaultdict
-from src.utils.obo_parser import GODag
+from src.utils.obo_parser import GODag, FastGODag
+from src.utils.ontology_cache import load_cache, save_cache
+
+# format of compiled GeneOntology, increase it when attributes are changed so
+# that caches of the old format are rebuilt
+COMPILED_FORMAT = 1
 
 
 def get_short_ns(long_ns):
@@ -88,18 +93,29 @@ class GeneOntology(dict):
         - dict of GO terms, you can visit it like dict,
             e.g. ontology['GO:0000005']
     """
-    def __init__(self, obo_file_path):
+    def __init__(self, obo_file_path, cache=True, fast=False):
         """
         :param obo_file_path: path to obo file
+        :param cache: whether to load (or save) the compiled ontology from
+            (or into) the cache "<obo_file_path>.<format>.pkl"
+        :param fast: whether to parse obo file by FastGODag, which gives the
+            same ontology as GODag
         :return: None
         """
         super(GeneOntology, self).__init__()
-        go_dag = GODag(obo_file_path, 'relationship')
+        if cache and load_cache(self, obo_file_path, COMPILED_FORMAT):
+            return
+        if fast:
+            go_dag = FastGODag(obo_file_path)
+        else:
+            go_dag = GODag(obo_file_path, 'relationship')
         self.alt_ids = go_dag.alt_ids
         for go_id, go_term in go_dag.items():
             self[go_id] = GOTerm(go_term)
         self._get_children()
         self._get_depth()
+        if cache:
+            save_cache(self, obo_file_path, COMPILED_FORMAT)
 
     def _get_children(self):
         """Fill in children of each term.
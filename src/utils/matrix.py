@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Conversion between nested dicts and SciPy sparse matrices.
+"""
+from collections import defaultdict
+import numpy as np
+from scipy import sparse
+
+
+def dict_to_csr(data, rows=None, columns=None, dtype=np.float64):
+    """Convert nested dict to SciPy CSR matrix.
+    :param data: dict like
+        { row1: { column1: value1, column2: value2, ... }, ... }
+        or { row1: [ column1, column2, ... ], ... } (values are 1)
+    :param rows: list of row ids, default: keys of data in sorted order,
+        rows not in data are left empty
+    :param columns: list of column ids, default: all columns appeared in data
+        in sorted order, columns not in this list are discarded
+    :param dtype: data type of the matrix
+    :return: CSR matrix, list of row ids, list of column ids
+    """
+    if rows is None:
+        rows = sorted(data)
+    if columns is None:
+        columns = sorted(set(column for row in data.values()
+                             for column in row))
+    column_index = {column: i for i, column in enumerate(columns)}
+
+    indptr, indices, values = [0], [], []
+    is_list = True
+    for row in rows:
+        entries = data.get(row, ())
+        if isinstance(entries, dict):
+            is_list = False
+            for column, value in entries.items():
+                if column in column_index:
+                    indices.append(column_index[column])
+                    values.append(value)
+        else:
+            for column in entries:
+                if column in column_index:
+                    indices.append(column_index[column])
+                    values.append(1)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix((np.asarray(values, dtype=dtype),
+                                np.asarray(indices, dtype=np.int32),
+                                np.asarray(indptr, dtype=np.int64)),
+                               shape=(len(rows), len(columns)))
+    matrix.sum_duplicates()
+    # repeated columns in lists mean the same label
+    if is_list:
+        matrix.data[:] = 1
+    return matrix, list(rows), list(columns)
+
+
+def csr_to_dict(matrix, rows, columns):
+    """Convert SciPy sparse matrix to nested dict, only stored entries are
+    kept.
+    :param matrix: SciPy sparse matrix
+    :param rows: list of row ids
+    :param columns: list of column ids
+    :return: dict like
+        { row1: { column1: value1, column2: value2, ... }, ... }
+    """
+    matrix = sparse.csr_matrix(matrix)
+    data = defaultdict(dict)
+    for i, row in enumerate(rows):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        if start == end:
+            continue
+        data[row] = dict(zip([columns[j] for j in matrix.indices[start:end]],
+                             matrix.data[start:end].tolist()))
+    return data
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Bulk loader of edge lists of PPI networks.
+
+The edge list is read in blocks of rows by pandas (.gz and other compressed
+files are decompressed on the fly), identifiers are mapped to proteins by
+vectorized lookups, unmapped or filtered rows are dropped in bulk, and the
+edges are symmetrized into a CSR adjacency matrix.
+"""
+import csv
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from joblib import Parallel, delayed
+
+
+def get_mapping_table(mapping):
+    """Convert mapping from identifiers to proteins into arrays.
+    :param mapping: dict, key: identifier, value: protein or set of proteins
+        { id1: protein1, id2: { protein2a, protein2b }, ... }
+    :return: pandas Index of identifiers, numpy array of pointers and numpy
+        array of protein indices in CSR layout (proteins of the i-th identifier
+        are indices[indptr[i]:indptr[i+1]]), list of proteins
+    """
+    identifiers = pd.Index(list(mapping))
+    targets = [[value] if isinstance(value, str) else sorted(value)
+               for value in mapping.values()]
+    proteins = sorted(set(protein for values in targets
+                          for protein in values))
+    protein_index = {protein: i for i, protein in enumerate(proteins)}
+    indptr = np.cumsum([0] + [len(values) for values in targets])
+    indices = np.array([protein_index[protein] for values in targets
+                        for protein in values], dtype=np.int32)
+    return identifiers, indptr, indices, proteins
+
+
+def map_edges(chunk, columns, table, score_column=None, filters=None,
+              normalizer=1.0):
+    """Map a block of edge list to protein edges.
+    :param chunk: DataFrame, block of edge list
+    :param columns: tuple of column indices of two interactors
+    :param table: identifiers, indptr and indices returned by
+        get_mapping_table
+    :param score_column: column index of scores, None means all scores are 1
+    :param filters: dict, key: column index, value: required value of the
+        column, rows not satisfying any of them are dropped
+    :param normalizer: scores are divided by normalizer
+    :return: numpy arrays of protein a, protein b, score and row order of
+        edges in chunk
+    """
+    identifiers, indptr, indices = table
+    keep = np.ones(len(chunk), dtype=bool)
+    for column, value in (filters or dict()).items():
+        keep &= (chunk[column] == value).values
+    code_a = identifiers.get_indexer(chunk[columns[0]])
+    code_b = identifiers.get_indexer(chunk[columns[1]])
+    # if no matched accession found, pass it
+    keep &= (code_a >= 0) & (code_b >= 0)
+    order = np.flatnonzero(keep)
+    code_a, code_b = code_a[keep], code_b[keep]
+    if score_column is None:
+        score = np.ones(len(order))
+    else:
+        score = chunk[score_column].values[keep].astype(np.float64) / \
+            normalizer
+    # expand each row to all pairs of proteins of two interactors
+    count_a = indptr[code_a + 1] - indptr[code_a]
+    count_b = indptr[code_b + 1] - indptr[code_b]
+    count = count_a * count_b
+    offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count,
+                                                count)
+    count_b = np.repeat(count_b, count)
+    protein_a = indices[np.repeat(indptr[code_a], count) + offset // count_b]
+    protein_b = indices[np.repeat(indptr[code_b], count) + offset % count_b]
+    return protein_a, protein_b, np.repeat(score, count), \
+        np.repeat(order, count)
+
+
+def load_edge_list(file_path, columns, mapping, score_column=None,
+                   filters=None, normalizer=1.0, sep='\t', header=0,
+                   comment=None, chunk_size=1 << 20, n_jobs=1):
+    """Load edge list into a symmetric adjacency matrix. As two interactors
+    are symmetric, the score of the last row of the same pair takes effect.
+    :param file_path: path to edge list, compressed files (e.g. .gz) are
+        accepted
+    :param columns: tuple of column indices of two interactors
+    :param mapping: dict, key: identifier in edge list, value: protein or set
+        of proteins
+    :param score_column: column index of scores, None means all scores are 1
+    :param filters: dict, key: column index, value: required value (str) of
+        the column, rows not satisfying any of them are dropped
+    :param normalizer: scores are divided by normalizer
+    :param sep: delimiter of columns, r"\\s+" means any whitespace
+    :param header: number of header lines to skip
+    :param comment: lines starting with it are skipped, None means no comment
+    :param chunk_size: number of rows read at a time
+    :param n_jobs: number of processes mapping blocks, -1 means using all
+        processors
+    :return: SciPy CSR matrix of float64, list of proteins (rows and columns
+        of the matrix)
+    """
+    identifiers, indptr, indices, proteins = get_mapping_table(mapping)
+    table = (identifiers, indptr, indices)
+    usecols = sorted(set(columns) | set(filters or dict()) |
+                     ({score_column} if score_column is not None else set()))
+    dtype = {column: str for column in usecols if column != score_column}
+    reader = pd.read_csv(file_path, sep=sep, header=None, skiprows=header,
+                         comment=comment, usecols=usecols, dtype=dtype,
+                         quoting=csv.QUOTE_NONE, compression="infer",
+                         chunksize=chunk_size)
+    if n_jobs == 1:
+        blocks = [map_edges(chunk, columns, table, score_column, filters,
+                            normalizer) for chunk in reader]
+    else:
+        blocks = Parallel(n_jobs=n_jobs, pre_dispatch="2*n_jobs")(
+            delayed(map_edges)(chunk, columns, table, score_column, filters,
+                               normalizer) for chunk in reader)
+
+    if len(blocks) == 0:
+        return sparse.csr_matrix((0, 0)), list()
+    # order of rows in the whole file
+    starts = np.cumsum([0] + [chunk_size] * (len(blocks) - 1))
+    protein_a = np.concatenate([block[0] for block in blocks])
+    protein_b = np.concatenate([block[1] for block in blocks])
+    score = np.concatenate([block[2] for block in blocks])
+    order = np.concatenate([block[3] + start
+                            for block, start in zip(blocks, starts)])
+    # keep the last row of each unordered pair
+    low, high = np.minimum(protein_a, protein_b), \
+        np.maximum(protein_a, protein_b)
+    rank = np.lexsort((order, high, low))
+    low, high, score = low[rank], high[rank], score[rank]
+    last = np.ones(len(low), dtype=bool)
+    last[:-1] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+    low, high, score = low[last], high[last], score[last]
+    # symmetrize, keep proteins having interactions only
+    loop = low == high
+    rows = np.concatenate((low, high[~loop]))
+    cols = np.concatenate((high, low[~loop]))
+    used, edges = np.unique(np.concatenate((rows, cols)),
+                            return_inverse=True)
+    adjacency = sparse.csr_matrix(
+        (np.concatenate((score, score[~loop])),
+         (edges[:len(rows)], edges[len(rows):])),
+        shape=(len(used), len(used)))
+    return adjacency, [proteins[i] for i in used]
+
+
+def prune_network(adjacency, min_score=None, top_k=None, max_edges=None):
+    """Sparsify network by dropping weak edges, criteria are applied in the
+    order of min_score, top_k and max_edges.
+    :param adjacency: adjacency matrix, SciPy sparse matrix
+    :param min_score: drop edges whose scores are less than it, None means no
+        threshold
+    :param top_k: keep edges being one of top k strongest edges of either
+        endpoint, so a symmetric network keeps symmetric, None means no limit
+    :param max_edges: keep the strongest max_edges edges (a pair of proteins
+        counts once), None means no limit
+    :return: pruned adjacency matrix, SciPy CSR matrix
+    """
+    adjacency = sparse.csr_matrix(adjacency, copy=True)
+    adjacency.sum_duplicates()
+    if min_score is not None:
+        adjacency.data[adjacency.data < min_score] = 0
+        adjacency.eliminate_zeros()
+
+    if top_k is not None:
+        # rank of each edge among edges of the same row, strongest first
+        rows = np.repeat(np.arange(adjacency.shape[0]),
+                         np.diff(adjacency.indptr))
+        order = np.lexsort((-adjacency.data, rows))
+        rank = np.empty(adjacency.nnz, dtype=np.int64)
+        rank[order] = np.arange(adjacency.nnz) - adjacency.indptr[rows[order]]
+        top = sparse.csr_matrix(
+            (rank < top_k, adjacency.indices, adjacency.indptr),
+            shape=adjacency.shape, copy=True)
+        top.eliminate_zeros()
+        adjacency = sparse.csr_matrix(adjacency.multiply(top + top.T))
+
+    if max_edges is not None:
+        # each pair of proteins counts once in the upper triangle
+        strength = sparse.triu(adjacency.maximum(adjacency.T)).tocoo()
+        if strength.nnz > max_edges:
+            strongest = np.argsort(-strength.data, kind="stable")[:max_edges]
+            keep = sparse.csr_matrix(
+                (np.ones(max_edges, dtype=bool),
+                 (strength.row[strongest], strength.col[strongest])),
+                shape=adjacency.shape)
+            adjacency = sparse.csr_matrix(adjacency.multiply(keep + keep.T))
+    return adjacency
@@ -11,6 +11,7 @@ from collections import defaultdict
 import sys
 import os
 import re
+import numpy as np
 
 GraphEngines = ("pygraphviz", "pydot")
 
@@ -386,6 +387,148 @@ class TypeDef(object):
         return "\n".join(ret)
 
 
+class OBOTerm(object):
+    """Light-weight term record read by FastGODag, only with the attributes
+    used by HumanPhenotypeOntology and GeneOntology.
+    """
+    __slots__ = ("id", "name", "namespace", "parents", "relationship")
+
+    def __init__(self, term_id, name, namespace):
+        self.id = term_id
+        self.name = name
+        self.namespace = namespace
+        self.parents = []           # is_a parent records
+        # "relationship" is set only if part_of parents exist, e.g.
+        # { "part_of": set of parent records }
+
+
+class FastGODag(dict):
+    """Fast reader of obo file, a drop-in of GODag(obo_file, 'relationship')
+    for HumanPhenotypeOntology and GeneOntology.
+
+    Only id, name, alt_id, namespace, is_a, relationship (part_of) and
+    is_obsolete are extracted. Lines are split by str.partition instead of
+    regular expressions, and parents are stored as integer arrays directly.
+    Level and depth of GODag are not computed.
+
+    Attributes:
+        - alt_ids: dict, alternative ids of terms, like GODag.alt_ids
+        - term_ids: list of non-obsolete terms, the order of integer ids
+        - is_a: (indptr, indices) of is_a parents in CSR layout, parents of
+            term_ids[i] are term_ids[j] for j in indices[indptr[i]:indptr[i+1]]
+        - part_of: (indptr, indices) of part_of parents, the same layout
+        - dict of OBOTerm records
+    """
+    def __init__(self, obo_file="go-basic.obo"):
+        self.alt_ids = defaultdict(list)
+        self.term_ids = []
+        self.version = self.load_obo_file(obo_file)
+
+    def load_obo_file(self, obo_file):
+        sys.stdout.write("load obo file %s\n" % obo_file)
+        names, namespaces, is_a, relationships = [], [], [], []
+        # typedef id --> typedef id it is inverse of
+        inverse_of = dict()
+        rec_id, typedef_id = None, None
+        obsolete = False
+        with open(obo_file) as fstream:
+            for line in fstream:
+                if line[0] == "[":
+                    if rec_id is not None and obsolete:
+                        self._remove_last(names, namespaces, is_a,
+                                          relationships)
+                    rec_id, typedef_id = None, None
+                    obsolete = False
+                    if line[0:6].lower() == "[term]":
+                        rec_id = ""
+                        names.append("")
+                        namespaces.append("")
+                        is_a.append([])
+                        relationships.append([])
+                    elif line[0:9].lower() == "[typedef]":
+                        typedef_id = ""
+                    continue
+                field_name, sep, field_value = line.partition(":")
+                if not sep:
+                    continue
+                field_value = field_value.strip()
+                if rec_id is not None:
+                    if field_name == "id":
+                        rec_id = field_value
+                        self.term_ids.append(rec_id)
+                    elif field_name == "is_a":
+                        is_a[-1].append(field_value.partition(" ")[0])
+                    elif field_name == "relationship":
+                        tokens = field_value.partition("!")[0].split()
+                        # skip malformed relationship without target
+                        if len(tokens) >= 2:
+                            relationships[-1].append(tuple(tokens[:2]))
+                    elif field_name == "name":
+                        names[-1] = field_value
+                    elif field_name == "namespace":
+                        namespaces[-1] = field_value
+                    elif field_name == "alt_id":
+                        self.alt_ids[rec_id].append(field_value)
+                    elif field_name == "is_obsolete":
+                        obsolete = field_value == "true"
+                elif typedef_id is not None:
+                    if field_name == "id":
+                        typedef_id = field_value
+                    elif field_name == "inverse_of":
+                        inverse_of[typedef_id] = \
+                            field_value.partition("!")[0].rstrip()
+        if rec_id is not None and obsolete:
+            self._remove_last(names, namespaces, is_a, relationships)
+
+        term_index = {term_id: i for i, term_id in enumerate(self.term_ids)}
+        # part_of parents, including the inverse of other relationships
+        part_of = [[] for _ in self.term_ids]
+        for i, term_relationships in enumerate(relationships):
+            for typedef, target in term_relationships:
+                if target not in term_index:
+                    continue
+                if typedef == "part_of":
+                    part_of[i].append(target)
+                elif inverse_of.get(typedef) == "part_of":
+                    part_of[term_index[target]].append(self.term_ids[i])
+        self.is_a = self._to_index(is_a, term_index)
+        self.part_of = self._to_index(part_of, term_index)
+
+        # records of terms
+        for i, term_id in enumerate(self.term_ids):
+            self[term_id] = OBOTerm(term_id, names[i], namespaces[i])
+        for (indptr, indices), attr in ((self.is_a, "is_a"),
+                                        (self.part_of, "part_of")):
+            for i, term_id in enumerate(self.term_ids):
+                parents = [self[self.term_ids[j]]
+                           for j in indices[indptr[i]:indptr[i + 1]]]
+                if attr == "is_a":
+                    self[term_id].parents = parents
+                elif len(parents) > 0:
+                    self[term_id].relationship = {"part_of": set(parents)}
+
+        version = "{OBO}: {N:,} Terms (fast)".format(OBO=obo_file, N=len(self))
+        sys.stdout.write("{VER}\n".format(VER=version))
+        return version
+
+    def _remove_last(self, names, namespaces, is_a, relationships):
+        """Discard the last (obsolete) term, its alt_ids are kept."""
+        self.term_ids.pop()
+        for values in (names, namespaces, is_a, relationships):
+            values.pop()
+
+    @staticmethod
+    def _to_index(parents, term_index):
+        """Convert lists of parent ids into (indptr, indices) arrays."""
+        indptr, indices = [0], []
+        for term_parents in parents:
+            indices.extend(term_index[p] for p in term_parents
+                           if p in term_index)
+            indptr.append(len(indices))
+        return np.array(indptr, dtype=np.int64), \
+            np.array(indices, dtype=np.int32)
+
+
 class GODag(dict):
 
     def __init__(self, obo_file="go-basic.obo", optional_attrs=None):
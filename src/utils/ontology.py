@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from collections import defaultdict
-from src.utils.obo_parser import GODag
+import numpy as np
+from scipy import sparse
+from src.utils.obo_parser import GODag, FastGODag
+from src.utils.ontology_cache import load_cache, save_cache
+
+# format of compiled HumanPhenotypeOntology, increase it when attributes are
+# changed so that caches of the old format are rebuilt
+COMPILED_FORMAT = 2
 
 
 def get_root():
@@ -154,6 +161,7 @@ class HPOTerm(object):
             - ns: namespace the term belongs to
             - children: set, children of this term
             - depth: the depth of term in the whole HPO
+            - ancestors: frozenset, this term and all its ancestors
         :param hpo_term: instance of the HPO term
         :return: None
         """
@@ -167,6 +175,7 @@ class HPOTerm(object):
         self.ns = hpo_term.namespace
         self.children = set()
         self.depth = 0
+        self.ancestors = frozenset()
 
 
 class HumanPhenotypeOntology(dict):
@@ -177,16 +186,37 @@ class HumanPhenotypeOntology(dict):
             { hpo_term1: [ alt_id1, alt_id2, ... ], ... }
         - root_term: root term of HPO, i.e. HP:0000001
         - subontology: list of root of subontology
+        - term_list: list of HPO terms, the order of integer ids
+        - term_index: dict, map from HPO term to its integer id
+        - ancestor_matrix: SciPy CSR matrix of bool, shape (n_terms, n_terms),
+            the element (i, j) is True iff term_list[j] is term_list[i] or
+            one of its ancestors
+        - descendant_matrix: transpose of ancestor_matrix in CSR format
+        - levels: list of (children, parents), numpy arrays of term ids of
+            edges from terms whose longest distance to leaves is 0, 1, 2, ...
+            to their parents, sorted by parents
         - dict of HPO terms, you can visit it like dict,
             e.g. ontology['HP:0000005']
     """
-    def __init__(self, obo_file_path, version="201902"):
+    def __init__(self, obo_file_path, version="201902", cache=True,
+                 fast=False):
         """
         :param obo_file_path: path to obo file
+        :param version: version of HPO
+        :param cache: whether to load (or save) the compiled ontology from
+            (or into) the cache "<obo_file_path>.<version>_<format>.pkl"
+        :param fast: whether to parse obo file by FastGODag, which gives the
+            same ontology as GODag
         :return: None
         """
         super(HumanPhenotypeOntology, self).__init__()
-        go_dag = GODag(obo_file_path, 'relationship')
+        if cache and load_cache(self, obo_file_path, version,
+                                COMPILED_FORMAT):
+            return
+        if fast:
+            go_dag = FastGODag(obo_file_path)
+        else:
+            go_dag = GODag(obo_file_path, 'relationship')
         self.alt_ids = go_dag.alt_ids
         for hpo_id, hpo_term in go_dag.items():
             self[hpo_id] = HPOTerm(hpo_term)
@@ -196,6 +226,10 @@ class HumanPhenotypeOntology(dict):
         self.version = version
         self.subontology = get_subontology(version)
         self._get_namespace()
+        self._get_ancestors()
+        self._get_levels()
+        if cache:
+            save_cache(self, obo_file_path, version, COMPILED_FORMAT)
 
     def _get_children(self):
         """Fill in children of each term.
@@ -238,21 +272,91 @@ class HumanPhenotypeOntology(dict):
                             self[child].ns = hpo2namespace[subontology]
                 now = next
 
+    def _get_ancestors(self):
+        """Fill in ancestors of each term once, i.e. the transitive closure,
+        and index it by a sparse term-by-term matrix.
+        :return: None
+        """
+        # visit parents before children (topological order)
+        n_parents = {hpo_term: len(self[hpo_term].parents) for hpo_term in self}
+        now = [hpo_term for hpo_term in self if n_parents[hpo_term] == 0]
+        while len(now) > 0:
+            next = list()
+            for hpo_term in now:
+                self[hpo_term].ancestors = frozenset([hpo_term]).union(
+                    *[self[parent].ancestors
+                      for parent in self[hpo_term].parents])
+                for child in self[hpo_term].children:
+                    n_parents[child] -= 1
+                    if n_parents[child] == 0:
+                        next.append(child)
+            now = next
+
+        self.term_list = sorted(self)
+        self.term_index = {hpo_term: i
+                           for i, hpo_term in enumerate(self.term_list)}
+        rows, cols = list(), list()
+        for hpo_term in self.term_list:
+            ancestors = self[hpo_term].ancestors
+            rows.extend([self.term_index[hpo_term]] * len(ancestors))
+            cols.extend([self.term_index[ancestor] for ancestor in ancestors])
+        self.ancestor_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(len(self.term_list), len(self.term_list)))
+        self.descendant_matrix = self.ancestor_matrix.transpose().tocsr()
+
+    def _get_levels(self):
+        """Group edges by the height of child terms (leaves are 0), so that
+        scores of a level are final once lower levels are propagated.
+        :return: None
+        """
+        height = dict()
+        n_children = {hpo_term: len(self[hpo_term].children)
+                      for hpo_term in self}
+        now = [hpo_term for hpo_term in self if n_children[hpo_term] == 0]
+        level = 0
+        while len(now) > 0:
+            next = list()
+            for hpo_term in now:
+                height[hpo_term] = level
+                for parent in self[hpo_term].parents:
+                    n_children[parent] -= 1
+                    if n_children[parent] == 0:
+                        next.append(parent)
+            now = next
+            level += 1
+
+        edges = [list() for _ in range(level)]
+        for hpo_term in height:
+            for parent in self[hpo_term].parents:
+                edges[height[hpo_term]].append(
+                    (self.term_index[parent], self.term_index[hpo_term]))
+        self.levels = list()
+        for level_edges in edges:
+            if len(level_edges) == 0:
+                continue
+            parents, children = np.array(sorted(level_edges)).T
+            self.levels.append((children, parents))
+
     def transfer(self, hpo_list):
         """Propagate HPO terms by true-path-rule.
         :param hpo_list: the HPO terms should be transferred
         :return: Propagated HPO terms of hpo_list
         """
-        hpo_list = list(filter(lambda x: x in self, hpo_list))
-        ancestors, now = set(hpo_list), set(hpo_list)
-        while len(now) > 0:
-            next = set()
-            for hpo_term in now:
-                if hpo_term in self:
-                    next |= self[hpo_term].parents - ancestors
-            now = next
-            ancestors |= now
-        return ancestors
+        return set().union(*[self[hpo_term].ancestors
+                             for hpo_term in hpo_list if hpo_term in self])
+
+    def propagate_matrix(self, annotation):
+        """Propagate a whole annotation matrix by true-path-rule.
+        :param annotation: SciPy sparse matrix (or numpy array) of shape
+            (n_proteins, n_terms), columns are in the order of term_list,
+            non-zero entries are annotations
+        :return: propagated annotations, SciPy CSR matrix of bool with the
+            same shape
+        """
+        annotation = sparse.csr_matrix(annotation, dtype=bool)
+        return sparse.csr_matrix(annotation @ self.ancestor_matrix,
+                                 dtype=bool)
 
     def transfer_scores(self, term_scores):
         """Keep the consistency of predictive scores - the score of the term
@@ -270,20 +374,61 @@ class HumanPhenotypeOntology(dict):
                 scores[parent_id] = max(scores[parent_id], scores[hpo_term])
         return scores
 
+    def transfer_scores_matrix(self, scores, hpo_list):
+        """Keep the consistency of predictive scores of many proteins at once -
+        the score of the term must not be less than the scores of all its
+        descendants (i.e. the same constraint as transfer_scores).
+
+        Edges are processed level by level from the leaves, and parents take
+        the maximum of their children's scores by numpy.maximum.reduceat.
+        :param scores: numpy array of shape (n_proteins, len(hpo_list)),
+            predictive scores of proteins on HPO terms
+        :param hpo_list: list of HPO terms, columns of scores
+        :return: consistent scores, numpy array of shape
+            (n_proteins, n_transferred), and list of propagated HPO terms of
+            hpo_list (columns of the array)
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        columns = [i for i, hpo_term in enumerate(hpo_list)
+                   if hpo_term in self]
+        term_ids = [self.term_index[hpo_list[i]] for i in columns]
+        # propagated HPO terms, i.e. columns of output
+        transferred = np.flatnonzero(
+            self.ancestor_matrix[term_ids].getnnz(axis=0))
+        position = np.full(len(self.term_list), -1)
+        position[transferred] = np.arange(len(transferred))
+
+        consistent = np.zeros((scores.shape[0], len(transferred)))
+        np.maximum.at(consistent, (slice(None), position[term_ids]),
+                      scores[:, columns])
+        for children, parents in self.levels:
+            # only edges among the propagated HPO terms
+            mask = position[children] >= 0
+            children, parents = position[children[mask]], \
+                position[parents[mask]]
+            if len(children) == 0:
+                continue
+            starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+            parents = parents[starts]
+            consistent[:, parents] = np.maximum(
+                consistent[:, parents],
+                np.maximum.reduceat(consistent[:, children], starts, axis=1))
+        return consistent, [self.term_list[i] for i in transferred]
+
     def get_descendants(self, hpo_list):
         """Get all descendants of hpo_term.
         :param hpo_list: list of queried HPO terms
         :return: set(), all descendants of hpo_term
         """
-        hpo_list = list(filter(lambda x: x in self, hpo_list))
-        descendants, now = set(), set(hpo_list)
-        while len(now) > 0:
-            next = set()
-            for hpo_term in now:
-                if hpo_term in self:
-                    next |= self[hpo_term].children - descendants
-            now = next
-            descendants |= now
+        descendants = set()
+        for hpo_term in hpo_list:
+            if hpo_term in self:
+                idx = self.term_index[hpo_term]
+                row = self.descendant_matrix.indices[
+                    self.descendant_matrix.indptr[idx]:
+                    self.descendant_matrix.indptr[idx + 1]]
+                descendants.update(self.term_list[i] for i in row
+                                   if i != idx)
         return descendants
 
     def get_ancestors(self, hpo_list):
@@ -291,13 +436,5 @@ class HumanPhenotypeOntology(dict):
         :param hpo_list: list of queried HPO terms
         :return: set(), all ancestors of hpo_term
         """
-        hpo_list = list(filter(lambda x: x in self, hpo_list))
-        ancestors, now = set(), set(hpo_list)
-        while len(now) > 0:
-            next = set()
-            for hpo_term in now:
-                if hpo_term in self:
-                    next |= self[hpo_term].parents - ancestors
-            now = next
-            ancestors |= now
-        return ancestors
+        return set().union(*[self[hpo_term].ancestors - {hpo_term}
+                             for hpo_term in hpo_list if hpo_term in self])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""On-disk cache of compiled ontologies.
+
+Parsing .obo file and filling in children, depth, namespaces, etc. is slow,
+so the compiled ontology (terms and attributes) is pickled next to the .obo
+file as "<obo_file_path>.<args>.pkl" and loaded back when the .obo file is
+unchanged. Each combination of extra arguments of the ontology (e.g. version)
+has its own cache file. The .obo file is taken as unchanged if its absolute
+path, modification time and size are the same as when the cache was saved,
+otherwise its SHA-1 is compared.
+"""
+import hashlib
+import os
+import pickle
+
+
+def get_cache_path(obo_file_path, *args):
+    """Return path to the cache of the .obo file compiled with args.
+    :param obo_file_path: path to obo file
+    :param args: extra arguments affecting the compiled ontology
+    :return: str, "<obo_file_path>.<args joined by '_'>.pkl", or
+        "<obo_file_path>.pkl" without args
+    """
+    if not args:
+        return obo_file_path + ".pkl"
+    return "{}.{}.pkl".format(obo_file_path,
+                              "_".join(str(arg) for arg in args))
+
+
+def get_file_stat(obo_file_path):
+    """Return cheap key of the .obo file.
+    :param obo_file_path: path to obo file
+    :return: tuple, (path, mtime, size)
+    """
+    stat = os.stat(obo_file_path)
+    return os.path.abspath(obo_file_path), stat.st_mtime, stat.st_size
+
+
+def get_file_hash(obo_file_path):
+    """Return SHA-1 of the .obo file.
+    :param obo_file_path: path to obo file
+    :return: str, hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(obo_file_path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def load_cache(ontology, obo_file_path, *args):
+    """Restore terms and attributes of ontology from the cache.
+    :param ontology: empty ontology instance (subclass of dict)
+    :param obo_file_path: path to obo file
+    :param args: extra arguments affecting the compiled ontology
+    :return: True if restored, False if cache is missing, stale or written by
+        an incompatible version of the classes
+    """
+    cache_path = get_cache_path(obo_file_path, *args)
+    if not os.path.exists(cache_path):
+        return False
+    try:
+        with open(cache_path, "rb") as fp:
+            # key is pickled ahead, so stale cache is detected cheaply
+            stat, sha1, cached_args = pickle.load(fp)
+            if cached_args != args:
+                return False
+            # hash the .obo file only if it seems to be modified
+            touched = stat != get_file_stat(obo_file_path)
+            if touched and sha1 != get_file_hash(obo_file_path):
+                return False
+            terms, attributes = pickle.load(fp)
+    except (OSError, EOFError, ValueError, TypeError, AttributeError,
+            ImportError, pickle.UnpicklingError):
+        return False
+    ontology.update(terms)
+    ontology.__dict__.update(attributes)
+    if touched:
+        # same content, refresh the key so later loads skip hashing
+        save_cache(ontology, obo_file_path, *args)
+    return True
+
+
+def save_cache(ontology, obo_file_path, *args):
+    """Pickle terms and attributes of ontology into the cache, the cache is
+    skipped silently if it can't be written.
+    :param ontology: compiled ontology instance (subclass of dict)
+    :param obo_file_path: path to obo file
+    :param args: extra arguments affecting the compiled ontology
+    :return: None
+    """
+    cache_path = get_cache_path(obo_file_path, *args)
+    try:
+        with open(cache_path, "wb") as fp:
+            pickle.dump((get_file_stat(obo_file_path),
+                         get_file_hash(obo_file_path), args), fp,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump((dict(ontology), ontology.__dict__), fp,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Vocabulary mapping identifiers (proteins, HPO/GO terms) to dense int32 ids.
+
+Identifiers are encoded once, so features, annotations and results can be
+joined as integer arrays instead of hashing strings over and over. The
+vocabulary is saved as a .npy file of identifiers, the id of an identifier is
+its position in the file.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _to_array(tokens):
+    """Convert iterable of identifiers to numpy array of str."""
+    if isinstance(tokens, (np.ndarray, pd.Index)):
+        return np.asarray(tokens).astype(str, copy=False)
+    return np.asarray(list(tokens), dtype=str)
+
+
+class Vocabulary(object):
+    """Vocabulary of identifiers.
+    Attributes:
+        - tokens: numpy array of identifiers, the i-th one has id i
+    """
+    def __init__(self, tokens=()):
+        """
+        :param tokens: iterable of identifiers, duplicates are ignored
+        :return: None
+        """
+        self._tokens = pd.unique(_to_array(tokens)).astype(str)
+        self._index = pd.Index(self._tokens)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, token):
+        return token in self._index
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def encode(self, tokens):
+        """Map identifiers to ids.
+        :param tokens: iterable of identifiers
+        :return: numpy array of int32, -1 for identifiers not in vocabulary
+        """
+        tokens = _to_array(tokens)
+        if len(tokens) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return self._index.get_indexer(tokens).astype(np.int32)
+
+    def decode(self, ids):
+        """Map ids to identifiers.
+        :param ids: array-like of ids
+        :return: numpy array of identifiers
+        """
+        return self.tokens[np.asarray(ids, dtype=np.int64)]
+
+    def intersect(self, tokens):
+        """Return identifiers in vocabulary, in the order of tokens.
+        :param tokens: iterable of identifiers
+        :return: numpy array of identifiers, numpy array of their ids
+        """
+        tokens = _to_array(tokens)
+        ids = self.encode(tokens)
+        found = ids >= 0
+        return tokens[found], ids[found]
+
+    def extend(self, tokens):
+        """Append new identifiers, ids of existing identifiers are unchanged.
+        :param tokens: iterable of identifiers
+        :return: number of identifiers appended
+        """
+        tokens = _to_array(tokens)
+        new_tokens = pd.unique(tokens[self.encode(tokens) < 0])
+        if len(new_tokens) > 0:
+            self._tokens = np.concatenate((self._tokens,
+                                           new_tokens.astype(str)))
+            self._index = pd.Index(self._tokens)
+        return len(new_tokens)
+
+    def save(self, file_path):
+        """Save vocabulary into .npy file.
+        :param file_path: path to .npy file
+        :return: None
+        """
+        np.save(file_path, self.tokens)
+
+    @classmethod
+    def load(cls, file_path):
+        """Load vocabulary saved by save.
+        :param file_path: path to .npy file
+        :return: Vocabulary
+        """
+        return cls(np.load(file_path))